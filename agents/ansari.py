@@ -1,25 +1,37 @@
+import asyncio
 import hashlib
 import json
 import logging
-import os
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import date, datetime
+from functools import partial
+from urllib.parse import urlparse
 
-import litellm
-from langfuse.model import CreateGeneration, CreateTrace
 
 from tools.search_hadith import SearchHadith
 from tools.search_mawsuah import SearchMawsuah
 from tools.search_quran import SearchQuran
+from tools.result_packer import pack_results
+from util.admission import get_limiter, release_stream
+from util.context_window import ContextWindow, budget_for_model
+from util.hedge import get_hedger
+from util.http_client import get_http_client
+from util.json_stream import JsonStringFieldWatcher
+from util.metrics import TurnMetrics, tool_request_seconds, turn_failures
+from util.single_flight import SingleFlight
+from util.tool_cache import ToolCache, get_tool_cache
 from util.prompt_mgr import PromptMgr
+from util.response_cache import get_response_cache
+from util.retry import Deadline, DeadlineExceeded, RetryPolicy
+from util.trace_exporter import get_trace_exporter
 
-if os.environ.get("LANGFUSE_SECRET_KEY"):
-    from langfuse import Langfuse
-
-    lf = Langfuse()
-    lf.auth_check()
-
+# Coalesces identical in-flight tool calls across all agents in the process
+tool_flights = SingleFlight()
+# Runs the tool calls of one assistant turn concurrently
+tool_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ansari-tool")
 
 logger = logging.getLogger(__name__ + ".Ansari")
 logger.setLevel(logging.INFO)
@@ -27,21 +39,243 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO) 
 logger.addHandler(console_handler)
 
+def build_tools(settings, http_client=None):
+    """Returns the search tools by function name."""
+    # Tools share one keep-alive connection pool across all agents by default
+    http_client = http_client or get_http_client(settings)
+    sq = SearchQuran(settings.KALEMAT_API_KEY.get_secret_value(), http_client)
+    sh = SearchHadith(settings.KALEMAT_API_KEY.get_secret_value(), http_client)
+    sm = SearchMawsuah(settings.VECTARA_AUTH_TOKEN.get_secret_value(), settings.VECTARA_CUSTOMER_ID, settings.VECTARA_CORPUS_ID, http_client)
+    return {sq.get_fn_name(): sq, sh.get_fn_name(): sh, sm.get_fn_name(): sm}
+
+
+def build_context_window(settings):
+    """Returns a ContextWindow for settings.MODEL."""
+    return ContextWindow(
+        settings.MODEL,
+        budget_for_model(settings.MODEL, settings.CONTEXT_TOKEN_BUDGETS, settings.CONTEXT_TOKEN_BUDGET),
+        settings.MAX_TOOL_RESULT_TOKENS,
+    )
+
+
 class Ansari:
+    """The shared, read-only part of an agent: settings, tools, function schemas and
+    system prompt. Build it once per variant and call `new_session()` for each
+    conversation instead of copying the agent."""
 
-    def __init__(self, settings, message_logger=None, json_format=False):
+    def __init__(
+        self,
+        settings,
+        message_logger=None,
+        json_format=False,
+        http_client=None,
+        tool_cache=None,
+        name=None,
+        tools=None,
+        context_window=None,
+    ):
         self.settings = settings
-        sq = SearchQuran(settings.KALEMAT_API_KEY.get_secret_value())
-        sh = SearchHadith(settings.KALEMAT_API_KEY.get_secret_value())
-        sm = SearchMawsuah(settings.VECTARA_AUTH_TOKEN.get_secret_value(), settings.VECTARA_CUSTOMER_ID, settings.VECTARA_CORPUS_ID)
-        self.tools = {sq.get_fn_name(): sq, sh.get_fn_name(): sh, sm.get_fn_name(): sm}
+        # Labels this variant's metrics
+        self.name = name or settings.SYSTEM_PROMPT_FILE_NAME
+        self.tool_cache = tool_cache or get_tool_cache(settings)
+        self.response_cache = get_response_cache(settings, self.name)
+        # Tools are stateless, so variants can share one set (see agents.variants)
+        self.tools = tools or build_tools(settings, http_client)
         self.model = settings.MODEL
-        self.pm = PromptMgr()
-        self.sys_msg = self.pm.bind(settings.SYSTEM_PROMPT_FILE_NAME).render()
+        self.pm = PromptMgr(
+            hot_reload=settings.PROMPT_HOT_RELOAD, preload=True, check_interval=settings.PROMPT_RELOAD_INTERVAL
+        )
+        # Bound once; rendering a compiled template only re-reads the file if it changed
+        self.sys_prompt = self.pm.bind(settings.SYSTEM_PROMPT_FILE_NAME)
+        self.greeting = self.pm.bind("greeting")
         self.functions = [x.get_function_description() for x in self.tools.values()]
-        self.message_history = [{"role": "system", "content": self.sys_msg}]
         self.json_format = json_format
         self.message_logger = message_logger
+        self.context_window = context_window or build_context_window(settings)
+        backoff = (settings.RETRY_INITIAL_BACKOFF, settings.RETRY_MAX_BACKOFF)
+        self.llm_retry = RetryPolicy(settings.RETRY_MAX_ATTEMPTS, *backoff)
+        self.tool_retry = RetryPolicy(settings.TOOL_RETRY_MAX_ATTEMPTS, *backoff)
+        # A round that fails mid-stream is retried up to MAX_FAILURES attempts in total
+        self.round_retry = RetryPolicy(settings.MAX_FAILURES, *backoff)
+
+    def new_session(self, message_logger=None, client=None):
+        return AnsariSession(self, message_logger or self.message_logger, client)
+
+    @property
+    def sys_msg(self):
+        return self.sys_prompt.render()
+
+    def greet(self):
+        return self.greeting.render()
+
+    def completion_args(self, message_history, use_function=True, timeout=30.0):
+        args = dict(
+            model=self.model,
+            messages=message_history,
+            stream=True,
+            timeout=timeout,
+            temperature=0.0,
+            metadata={"generation-name": "ansari"},
+        )
+        if use_function:
+            if self.settings.PARALLEL_TOOL_CALLS:
+                args["tools"] = [{"type": "function", "function": f} for f in self.functions]
+            else:
+                args["functions"] = self.functions
+        if self.json_format:
+            args["response_format"] = {"type": "json_object"}
+        return args
+
+    def hedged(self, tool, run, client=None, deadline=None, is_async=False):
+        """Wraps a tool's run method in the tool's Hedger, if hedging is on, and its
+        backend's admission limiter, if it has limits. Hedge delays and budgets are
+        per tool, since tools on one host differ in latency, while admission is per
+        host. Every request, hedges included, holds an admission slot while it runs;
+        `client` is who it is queued for."""
+        hedger = get_hedger(self.settings, tool.get_fn_name())
+        limiter = get_limiter(self.settings, urlparse(tool.base_url).hostname)
+        if hedger is not None:
+            admission = (limiter, client, deadline) if limiter is not None else None
+            return partial(hedger.acall if is_async else hedger.call, run, admission=admission)
+        if limiter is not None:
+            return (limiter.awrap if is_async else limiter.wrap)(run, client, deadline)
+        return run
+
+    def run_tool(self, function_name, query, deadline=None, client=None, on_sleep=None):
+        """Returns the tool's results: formatted strings, or [id, text] passages
+        if PACK_TOOL_RESULTS is set. Transient errors are retried within `deadline`.
+        `client` is who the request is queued for if the tool's backend is limited,
+        and `on_sleep` is called with each retry wait."""
+        tool = self.tools[function_name]
+        num_results = tool.get_num_results()
+        kind = "passages" if self.settings.PACK_TOOL_RESULTS else "list"
+        key = ToolCache.make_key(function_name, query, num_results, kind)
+        if self.tool_cache:
+            results = self.tool_cache.get(key)
+            if results is not None:
+                return results
+
+        def fetch():
+            start = time.monotonic()
+            run = self.hedged(tool, tool.run_as_passages if kind == "passages" else tool.run_as_list, client, deadline)
+            results = self.tool_retry.call(run, query, num_results, deadline=deadline, on_sleep=on_sleep)
+            tool_request_seconds.observe(time.monotonic() - start, tool=function_name)
+            if self.tool_cache:
+                self.tool_cache.set(key, results)
+            return results
+
+        # Identical calls already in flight (e.g. from the other side of a
+        # comparison) wait for that call instead of hitting the API again.
+        return tool_flights.do(key, fetch, deadline)
+
+    def start_speculative_call(self, function_name, query, deadline=None, client=None, on_sleep=None):
+        """Starts a tool call as soon as its query is known, while the model is
+        still streaming the rest of the arguments. Returns the pending result, or
+        None if speculation is off or the function is unknown."""
+        if not self.settings.SPECULATIVE_TOOL_CALLS or function_name not in self.tools:
+            return None
+        return tool_executor.submit(self.run_tool, function_name, query, deadline, client, on_sleep)
+
+    def call_tool(self, function_name, function_arguments, speculative=None, deadline=None, client=None, on_sleep=None):
+        """Runs one function call and returns its results, or None if the function is unknown.
+
+        If a speculative call was started for the same function and query, its
+        result is used; if the final arguments differ, it is simply ignored.
+        Raises DeadlineExceeded if a speculative call is not done before `deadline`.
+        """
+        if function_name in self.tools.keys():
+            args = json.loads(function_arguments)
+            query = args["query"]
+            pending = (speculative or {}).get((function_name, query))
+            if pending is not None:
+                try:
+                    results = pending.result(timeout=deadline.timeout() if deadline else None)
+                except FutureTimeoutError:
+                    raise DeadlineExceeded(f"Turn deadline exceeded waiting for {function_name}")
+            else:
+                # Runs in this thread, which may itself be a tool_executor worker
+                results = self.run_tool(function_name, query, deadline, client, on_sleep)
+            logger.debug(f"Results are {results}")
+            return results
+        else:
+            logger.warning(f"Unknown function name: {function_name}")
+            return None
+
+
+class AnsariSession:
+    """The per-conversation state of an Ansari agent.
+
+    Holds only a reference to the shared engine plus the message history, so
+    creating one per user message is nearly free.
+    """
+
+    __slots__ = (
+        "engine", "message_history", "message_logger", "start_time", "round_stats", "turn", "deadline",
+        "client",
+    )
+
+    def __init__(self, engine, message_logger=None, client=None):
+        self.engine = engine
+        # Who this session's upstream calls are queued for (see util.admission)
+        self.client = client
+        self.message_history = [{"role": "system", "content": engine.sys_msg}]
+        self.message_logger = message_logger
+        self.start_time = None
+        self.round_stats = []
+        self.turn = TurnMetrics(engine.name)
+        self.deadline = Deadline(engine.settings.TURN_DEADLINE)
+
+    def start_turn(self):
+        self.start_time = datetime.now()
+        self.round_stats = []
+        self.turn = TurnMetrics(self.engine.name)
+        self.deadline = Deadline(self.engine.settings.TURN_DEADLINE)
+
+    def finish_turn(self):
+        """Records the turn's metrics and returns them as a dict."""
+        return self.turn.finish(self.round_stats)
+
+    def turn_metrics(self):
+        return self.turn.as_dict(self.round_stats)
+
+    def record_retry_sleep(self, seconds):
+        self.turn.retry_sleep += seconds
+
+    def retry_sleep(self, seconds):
+        self.record_retry_sleep(seconds)
+        time.sleep(seconds)
+
+    def start_speculative_call(self, function_name, query):
+        return self.engine.start_speculative_call(
+            function_name, query, self.deadline, self.client, self.record_retry_sleep
+        )
+
+    def call_tool(self, function_name, function_arguments, speculative=None):
+        start = time.monotonic()
+        results = self.engine.call_tool(
+            function_name, function_arguments, speculative, self.deadline, self.client, self.record_retry_sleep
+        )
+        if results is not None:
+            self.turn.add_tool_call(function_name, time.monotonic() - start)
+        return results
+
+    def fit_context(self):
+        """Returns the messages to send this round, trimmed to the token budget,
+        and records the round's token counts in `round_stats`."""
+        messages, stats = self.engine.context_window.fit(self.message_history, pack_results)
+        self.round_stats.append(stats)
+        logger.info(
+            f"Round {len(self.round_stats)}: {stats['prompt_tokens']} prompt tokens "
+            f"({stats['input_tokens']} before trimming, {stats['dropped']} messages dropped, "
+            f"{stats['truncated']} truncated)"
+        )
+        return messages
+
+    def record_completion_tokens(self, stream_round):
+        text = stream_round.words or stream_round.function_arguments or "".join(
+            call["arguments"] for call in stream_round.get_tool_calls()
+        )
+        self.round_stats[-1]["completion_tokens"] = self.engine.context_window.count(text)
 
     def set_message_logger(self, message_logger):
         self.message_logger = message_logger
@@ -53,43 +287,38 @@ class Ansari:
         result = hashlib.md5(hashstring.encode())
         return "chash_" + result.hexdigest()
 
-    def greet(self):
-        self.greeting = self.pm.bind("greeting")
-        return self.greeting.render()
-
     def process_input(self, user_input):
         self.message_history.append({"role": "user", "content": user_input})
         return self.process_message_history()
 
     def log(self):
-        if not os.environ.get("LANGFUSE_SECRET_KEY"):
+        exporter = get_trace_exporter(self.engine.settings)
+        if exporter is None:
             return
         trace_id = self.compute_trace_id()
         logger.info(f"trace id is {trace_id}")
-        trace = lf.trace(CreateTrace(id=trace_id, name="ansari-trace"))
-
-        generation = trace.generation(
-            CreateGeneration(
-                name="ansari-gen",
-                startTime=self.start_time,
-                endTime=datetime.now(),
-                model=self.settings.MODEL,
-                prompt=self.message_history[:-1],
-                completion=self.message_history[-1]["content"],
-            )
+        exporter.submit(
+            trace_id,
+            self.start_time,
+            datetime.now(),
+            self.engine.model,
+            self.message_history[:-1],
+            self.message_history[-1]["content"],
         )
 
+    def resume(self, message_history):
+        """Restores a stored conversation: its messages after the system prompt, tool results included."""
+        self.message_history = [{"role": "system", "content": self.engine.sys_msg}] + message_history
+
     def replace_message_history(self, message_history):
-        self.message_history = [
-            {"role": "system", "content": self.sys_msg}
-        ] + message_history
+        self.resume(message_history)
         for m in self.process_message_history():
             if m:
                 yield m
 
     def process_message_history(self):
         # Keep processing the user input until we get something from the assistant
-        self.start_time = datetime.now()
+        self.start_turn()
         count = 0
         failures = 0
         while self.message_history[-1]["role"] != "assistant":
@@ -99,167 +328,459 @@ class Ansari:
                 # We want to yield from so that we can send the sequence through the input
                 # Also use functions only if we haven't tried too many times
                 use_function = True
-                if count >= self.settings.MAX_FUNCTION_TRIES:
+                if count >= self.engine.settings.MAX_FUNCTION_TRIES:
                     use_function = False
                     logger.warning("Not using functions -- tries exceeded")
-                yield from self.process_one_round(use_function)
+                for m in self.process_one_round(use_function):
+                    if m:
+                        self.turn.mark_first_token()
+                    yield m
                 count += 1
             except Exception as e:
                 failures += 1
-                logger.warning("Exception occurred: {e}")
+                logger.warning(f"Exception occurred: {e}")
                 logger.warning(traceback.format_exc())
-                logger.warning("Retrying in 5 seconds...")
-                time.sleep(5)
-                if failures >= self.settings.MAX_FAILURES:
-                    logger.error("Too many failures, aborting")
-                    raise Exception("Too many failures")
-                    break
+                delay = self.engine.round_retry.retry_delay(e, failures, self.deadline)
+                if delay is None:
+                    logger.error("Giving up on this turn")
+                    turn_failures.inc(variant=self.engine.name)
+                    raise
+                logger.warning(f"Retrying in {delay:.2f} seconds...")
+                self.retry_sleep(delay)
+        self.finish_turn()
         self.log()
 
+    def start_completion(self, messages, use_function):
+        import litellm  # deferred: importing litellm takes seconds
+
+        args = self.engine.completion_args(messages, use_function, self.deadline.timeout(30.0))
+        cache = self.engine.response_cache
+        key = cache and cache.make_key(args)
+        if key:
+            deltas = cache.get(key)
+            if deltas is not None:
+                return cache.replay(deltas)
+
+        def start():
+            started = time.monotonic()
+            response = litellm.completion(**args)
+            return cache.record(key, response, started) if key else response
+
+        # The stream holds its admission until process_one_round has read it
+        limiter = get_limiter(self.engine.settings, self.engine.model)
+        if limiter is None:
+            return start()
+        return limiter.admit_stream(start, self.client, self.round_stats[-1]["prompt_tokens"], self.deadline)
+
     def process_one_round(self, use_function=True):
-        response = None
-        failures = 0
-        while not response:
-            try:
-                if use_function:
-                    if self.json_format:
-                        response = litellm.completion(
-                            model=self.model,
-                            messages=self.message_history,
-                            stream=True,
-                            functions=self.functions,
-                            timeout=30.0,
-                            temperature=0.0,
-                            metadata={"generation-name": "ansari"},
-                            response_format={"type": "json_object"},
-                            num_retries=1,
-                        )
-                    else:
-                        response = litellm.completion(
-                            model=self.model,
-                            messages=self.message_history,
-                            stream=True,
-                            functions=self.functions,
-                            timeout=30.0,
-                            temperature=0.0,
-                            metadata={"generation-name": "ansari"},
-                            num_retries=1,
-                        )
-                else:
-                    if self.json_format:
-                        response = litellm.completion(
-                            model=self.model,
-                            messages=self.message_history,
-                            stream=True,
-                            timeout=30.0,
-                            temperature=0.0,
-                            response_format={"type": "json_object"},
-                            metadata={"generation-name": "ansari"},
-                            num_retries=1,
-                        )
-                    else:
-                        response = litellm.completion(
-                            model=self.model,
-                            messages=self.message_history,
-                            stream=True,
-                            timeout=30.0,
-                            temperature=0.0,
-                            metadata={"generation-name": "ansari"},
-                            num_retries=1,
-                        )
+        # Fitted once per round, so retried requests do not add rounds to the metrics
+        messages = self.fit_context()
+        response = self.engine.llm_retry.call(
+            self.start_completion, messages, use_function, deadline=self.deadline, on_sleep=self.record_retry_sleep
+        )
 
-            except Exception as e:
-                failures += 1
-                logger.warning("Exception occurred: ", e)
-                logger.warning(traceback.format_exc())
-                logger.warning("Retrying in 5 seconds...")
-                time.sleep(5)
-                if failures >= self.settings.MAX_FAILURES:
-                    logger.error("Too many failures, aborting")
-                    raise Exception("Too many failures")
+        stream_round = StreamRound(self.start_speculative_call)
+        try:
+            for tok in response:
+                self.deadline.check()
+                logger.debug(f"Tok is {tok}")
+                content = stream_round.feed(tok.choices[0].delta)
+                if content is not None:
+                    yield content
+                if stream_round.done:
                     break
+        finally:
+            release_stream(response)
+        stream_round.finish()
+        self.record_completion_tokens(stream_round)
 
-        words = ""
-        function_name = ""
-        function_arguments = ""
-        response_mode = ""  # words or fn
-        for tok in response:
-            logger.debug(f"Tok is {tok}")
-            delta = tok.choices[0].delta
-            if not response_mode:
-                # This code should only trigger the first
-                # time through the loop.
-                if "function_call" in delta and delta.function_call:
-                    # We are in function mode
-                    response_mode = "fn"
-                    function_name = delta.function_call.name
-                else:
-                    response_mode = "words"
-                logger.info("Response mode: " + response_mode)
-
-            # We process things differently depending on whether it is a function or a
-            # text
-            if response_mode == "words":
-                if delta.content == None:  # End token
-                    self.message_history.append({"role": "assistant", "content": words})
-                    if self.message_logger:
-                        self.message_logger.log("assistant", words)
-                    break
-                elif delta.content != None:
-                    words += delta.content
-                    yield delta.content
-                else:
-                    continue
-            elif response_mode == "fn":
-                logger.debug("Delta in: ", delta)
-                if (
-                    not "function_call" in delta or delta["function_call"] is None
-                ):  # End token
-                    function_call = function_name + "(" + function_arguments + ")"
-                    # The function call below appends the function call to the message history
-                    print(f"{function_name=}, {function_arguments=}")
-                    yield self.process_fn_call(input, function_name, function_arguments)
-                    #
-                    break
-                elif (
-                    "function_call" in delta
-                    and delta.function_call
-                    and delta.function_call.arguments
-                ):
-                    function_arguments += delta.function_call.arguments
-                    logger.debug(f"Function arguments are {function_arguments}")
-                    yield ""  # delta['function_call']['arguments'] # we shouldn't yield anything if it's a fn
-                else:
-                    logger.warning(f"Weird delta: {delta}")
-                    continue
+        if stream_round.response_mode == "words":
+            self.append_words(stream_round.words)
+        elif stream_round.response_mode == "fn":
+            # The function call below appends the function call to the message history
+            logger.info(f"Function call {stream_round.function_name}({stream_round.function_arguments})")
+            yield self.process_fn_call(
+                input, stream_round.function_name, stream_round.function_arguments,
+                stream_round.speculative,
+            )
+        elif stream_round.response_mode == "tools":
+            yield self.process_tool_calls(stream_round.get_tool_calls(), stream_round.speculative)
+
+    def append_words(self, words):
+        self.message_history.append({"role": "assistant", "content": words})
+        if self.message_logger:
+            self.message_logger.log("assistant", words)
+
+    def append_fn_results(self, function_name, results):
+        if self.engine.settings.PACK_TOOL_RESULTS:
+            # One compact message per call; passages still in the prompt from
+            # earlier calls are replaced by references when it is fitted
+            content = pack_results(results)
+            self.message_history.append(
+                {"role": "function", "name": function_name, "content": content, "passages": results}
+            )
+            if self.message_logger:
+                self.message_logger.log("function", content, function_name)
+            return
+        # Now we have to pass the results back in
+        if len(results) > 0:
+            for result in results:
+                self.message_history.append(
+                    {"role": "function", "name": function_name, "content": result}
+                )
+                if self.message_logger:
+                    self.message_logger.log("function", result, function_name)
+        else:
+            self.message_history.append(
+                {
+                    "role": "function",
+                    "name": function_name,
+                    "content": "No results found",
+                }
+            )
+            if self.message_logger:
+                self.message_logger.log(
+                    "function", "No results found", function_name
+                )
+
+    def append_tool_results(self, tool_calls, results_per_call):
+        """Appends one assistant tool_calls turn and its results, in call order."""
+        self.message_history.append(
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": call["id"],
+                        "type": "function",
+                        "function": {"name": call["name"], "arguments": call["arguments"]},
+                    }
+                    for call in tool_calls
+                ],
+            }
+        )
+        for call, results in zip(tool_calls, results_per_call):
+            message = {"role": "tool", "tool_call_id": call["id"], "name": call["name"]}
+            if results is None:
+                content = f"Unknown function: {call['name']}"
+            elif self.engine.settings.PACK_TOOL_RESULTS:
+                content = pack_results(results)
+                message["passages"] = results
+            elif len(results) > 0:
+                content = "\n\n".join(results)
+            else:
+                content = "No results found"
+            message["content"] = content
+            self.message_history.append(message)
+            if self.message_logger:
+                self.message_logger.log("tool", content, call["name"])
+
+    def process_fn_call(self, orig_question, function_name, function_arguments, speculative=None):
+        results = self.call_tool(function_name, function_arguments, speculative)
+        if results is not None:
+            self.append_fn_results(function_name, results)
+
+    def process_tool_calls(self, tool_calls, speculative=None):
+        # Results are only appended once every call has succeeded, so a retry
+        # never sees a tool_calls turn without its answers.
+        futures = [
+            tool_executor.submit(self.call_tool, call["name"], call["arguments"], speculative)
+            for call in tool_calls
+        ]
+        self.append_tool_results(tool_calls, [f.result() for f in futures])
+
+
+class StreamRound:
+    """Accumulates the streamed deltas of one LLM round.
+
+    The first delta decides whether the round is a text answer ("words"), a
+    legacy function call ("fn") or one or more parallel tool calls ("tools").
+    `feed` returns the text to pass on to the user (an
+    empty string while function arguments stream in) and sets `done` once the
+    end token arrives. Shared by the sync and async engines.
+
+    Chunks are collected in lists and joined once. If `on_query` is given, it is
+    called with (function name, query) as soon as a call's "query" argument has
+    closed, and whatever it returns is kept in `speculative` under that key.
+    """
+
+    def __init__(self, on_query=None):
+        self.word_parts = []
+        self.function_name = ""
+        self.argument_parts = []
+        self.tool_calls = {}  # index -> {"id", "name", "argument_parts"}
+        self.watchers = {}  # index -> JsonStringFieldWatcher
+        self.on_query = on_query
+        self.speculative = {}  # (function name, query) -> pending result
+        self.response_mode = ""  # words, fn or tools
+        self.done = False
+
+    @property
+    def words(self):
+        return "".join(self.word_parts)
+
+    @property
+    def function_arguments(self):
+        return "".join(self.argument_parts)
+
+    def watch_arguments(self, index, function_name, chunk):
+        if not self.on_query:
+            return
+        watcher = self.watchers.get(index)
+        if watcher is None:
+            watcher = self.watchers[index] = JsonStringFieldWatcher("query")
+        query = watcher.feed(chunk)
+        if query is not None and (function_name, query) not in self.speculative:
+            pending = self.on_query(function_name, query)
+            if pending is not None:
+                self.speculative[(function_name, query)] = pending
+
+    def feed(self, delta):
+        if not self.response_mode:
+            # This code should only trigger the first
+            # time through the loop.
+            if "tool_calls" in delta and delta.tool_calls:
+                self.response_mode = "tools"
+            elif "function_call" in delta and delta.function_call:
+                # We are in function mode
+                self.response_mode = "fn"
+                self.function_name = delta.function_call.name
             else:
-                raise Exception("Invalid response mode: " + response_mode)
+                self.response_mode = "words"
+            logger.info("Response mode: " + self.response_mode)
 
-    def process_fn_call(self, orig_question, function_name, function_arguments):
+        # We process things differently depending on whether it is a function or a
+        # text
+        if self.response_mode == "words":
+            if delta.content == None:  # End token
+                self.done = True
+                return None
+            self.word_parts.append(delta.content)
+            return delta.content
+        elif self.response_mode == "fn":
+            logger.debug("Delta in: ", delta)
+            if (
+                not "function_call" in delta or delta["function_call"] is None
+            ):  # End token
+                self.done = True
+                return None
+            elif delta.function_call.arguments:
+                self.argument_parts.append(delta.function_call.arguments)
+                self.watch_arguments(0, self.function_name, delta.function_call.arguments)
+                return ""  # we shouldn't yield anything if it's a fn
+            else:
+                logger.warning(f"Weird delta: {delta}")
+                return None
+        elif self.response_mode == "tools":
+            if not "tool_calls" in delta or not delta.tool_calls:  # End token
+                self.done = True
+                return None
+            for tool_call in delta.tool_calls:
+                index = tool_call.index
+                if index is None:
+                    index = max(self.tool_calls, default=0)
+                call = self.tool_calls.setdefault(index, {"id": "", "name": "", "argument_parts": []})
+                if tool_call.id:
+                    call["id"] = tool_call.id
+                if tool_call.function.name:
+                    call["name"] = tool_call.function.name
+                if tool_call.function.arguments:
+                    call["argument_parts"].append(tool_call.function.arguments)
+                    self.watch_arguments(index, call["name"], tool_call.function.arguments)
+            return ""
+        else:
+            raise Exception("Invalid response mode: " + self.response_mode)
+
+    def get_tool_calls(self):
+        return [
+            {"id": call["id"], "name": call["name"], "arguments": "".join(call["argument_parts"])}
+            for call in (self.tool_calls[i] for i in sorted(self.tool_calls))
+        ]
+
+    def finish(self):
+        """Treats the end of the stream as an end token if none was sent."""
+        self.done = True
+
+
+class AsyncAnsari(Ansari):
+    """Asyncio twin of Ansari.
+
+    Uses litellm.acompletion and the tools' async `arun_as_list`, and sleeps with
+    asyncio.sleep, so one event loop can serve many conversations without tying
+    up a thread per stream. Its sessions' `replace_message_history` is an async
+    generator that Gradio can consume directly.
+    """
+
+    def new_session(self, message_logger=None, client=None):
+        return AsyncAnsariSession(self, message_logger or self.message_logger, client)
+
+    async def run_tool(self, function_name, query, deadline=None, client=None, on_sleep=None):
+        tool = self.tools[function_name]
+        num_results = tool.get_num_results()
+        kind = "passages" if self.settings.PACK_TOOL_RESULTS else "list"
+        key = ToolCache.make_key(function_name, query, num_results, kind)
+        if self.tool_cache:
+            results = self.tool_cache.get(key)
+            if results is not None:
+                return results
+
+        async def fetch():
+            start = time.monotonic()
+            run = tool.arun_as_passages if kind == "passages" else tool.arun_as_list
+            run = self.hedged(tool, run, client, deadline, is_async=True)
+            results = await self.tool_retry.acall(run, query, num_results, deadline=deadline, on_sleep=on_sleep)
+            tool_request_seconds.observe(time.monotonic() - start, tool=function_name)
+            if self.tool_cache:
+                self.tool_cache.set(key, results)
+            return results
+
+        return await tool_flights.ado(key, fetch, deadline)
+
+    def start_speculative_call(self, function_name, query, deadline=None, client=None, on_sleep=None):
+        if not self.settings.SPECULATIVE_TOOL_CALLS or function_name not in self.tools:
+            return None
+        task = asyncio.create_task(self.run_tool(function_name, query, deadline, client, on_sleep))
+        # Unused speculative calls may fail; don't log them as never retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def call_tool(
+        self, function_name, function_arguments, speculative=None, deadline=None, client=None, on_sleep=None
+    ):
         if function_name in self.tools.keys():
             args = json.loads(function_arguments)
             query = args["query"]
-            results = self.tools[function_name].run_as_list(query)
+            pending = (speculative or {}).get((function_name, query))
+            if pending is None:
+                pending = self.run_tool(function_name, query, deadline, client, on_sleep)
+            try:
+                results = await asyncio.wait_for(pending, deadline.timeout() if deadline else None)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"Turn deadline exceeded waiting for {function_name}")
             logger.debug(f"Results are {results}")
-            # Now we have to pass the results back in
-            if len(results) > 0:
-                for result in results:
-                    self.message_history.append(
-                        {"role": "function", "name": function_name, "content": result}
-                    )
-                    if self.message_logger:
-                        self.message_logger.log("function", result, function_name)
-            else:
-                self.message_history.append(
-                    {
-                        "role": "function",
-                        "name": function_name,
-                        "content": "No results found",
-                    }
-                )
-                if self.message_logger:
-                    self.message_logger.log(
-                        "function", "No results found", function_name
-                    )
+            return results
         else:
             logger.warning(f"Unknown function name: {function_name}")
+            return None
+
+
+class AsyncAnsariSession(AnsariSession):
+    __slots__ = ()
+
+    async def retry_sleep(self, seconds):
+        self.record_retry_sleep(seconds)
+        await asyncio.sleep(seconds)
+
+    async def call_tool(self, function_name, function_arguments, speculative=None):
+        start = time.monotonic()
+        results = await self.engine.call_tool(
+            function_name, function_arguments, speculative, self.deadline, self.client, self.record_retry_sleep
+        )
+        if results is not None:
+            self.turn.add_tool_call(function_name, time.monotonic() - start)
+        return results
+
+    async def process_input(self, user_input):
+        self.message_history.append({"role": "user", "content": user_input})
+        async for m in self.process_message_history():
+            yield m
+
+    async def replace_message_history(self, message_history):
+        self.resume(message_history)
+        async for m in self.process_message_history():
+            if m:
+                yield m
+
+    async def process_message_history(self):
+        self.start_turn()
+        count = 0
+        failures = 0
+        while self.message_history[-1]["role"] != "assistant":
+            try:
+                logger.info(f"Processing one round {self.message_history}")
+                use_function = True
+                if count >= self.engine.settings.MAX_FUNCTION_TRIES:
+                    use_function = False
+                    logger.warning("Not using functions -- tries exceeded")
+                async for m in self.process_one_round(use_function):
+                    if m:
+                        self.turn.mark_first_token()
+                    yield m
+                count += 1
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Exception occurred: {e}")
+                logger.warning(traceback.format_exc())
+                delay = self.engine.round_retry.retry_delay(e, failures, self.deadline)
+                if delay is None:
+                    logger.error("Giving up on this turn")
+                    turn_failures.inc(variant=self.engine.name)
+                    raise
+                logger.warning(f"Retrying in {delay:.2f} seconds...")
+                await self.retry_sleep(delay)
+        self.finish_turn()
+        self.log()
+
+    async def start_completion(self, messages, use_function):
+        import litellm
+
+        args = self.engine.completion_args(messages, use_function, self.deadline.timeout(30.0))
+        cache = self.engine.response_cache
+        key = cache and cache.make_key(args)
+        if key:
+            deltas = cache.get(key)
+            if deltas is not None:
+                return cache.areplay(deltas)
+
+        async def start():
+            started = time.monotonic()
+            response = await litellm.acompletion(**args)
+            return cache.arecord(key, response, started) if key else response
+
+        limiter = get_limiter(self.engine.settings, self.engine.model)
+        if limiter is None:
+            return await start()
+        return await limiter.aadmit_stream(start, self.client, self.round_stats[-1]["prompt_tokens"], self.deadline)
+
+    async def process_one_round(self, use_function=True):
+        messages = self.fit_context()
+        response = await self.engine.llm_retry.acall(
+            self.start_completion, messages, use_function, deadline=self.deadline, on_sleep=self.record_retry_sleep
+        )
+
+        stream_round = StreamRound(self.start_speculative_call)
+        try:
+            async for tok in response:
+                self.deadline.check()
+                logger.debug(f"Tok is {tok}")
+                content = stream_round.feed(tok.choices[0].delta)
+                if content is not None:
+                    yield content
+                if stream_round.done:
+                    break
+        finally:
+            release_stream(response)
+        stream_round.finish()
+        self.record_completion_tokens(stream_round)
+
+        if stream_round.response_mode == "words":
+            self.append_words(stream_round.words)
+        elif stream_round.response_mode == "fn":
+            logger.info(f"Function call {stream_round.function_name}({stream_round.function_arguments})")
+            yield await self.process_fn_call(
+                input, stream_round.function_name, stream_round.function_arguments,
+                stream_round.speculative,
+            )
+        elif stream_round.response_mode == "tools":
+            yield await self.process_tool_calls(stream_round.get_tool_calls(), stream_round.speculative)
+
+    async def process_fn_call(self, orig_question, function_name, function_arguments, speculative=None):
+        results = await self.call_tool(function_name, function_arguments, speculative)
+        if results is not None:
+            self.append_fn_results(function_name, results)
+
+    async def process_tool_calls(self, tool_calls, speculative=None):
+        results_per_call = await asyncio.gather(
+            *[self.call_tool(call["name"], call["arguments"], speculative) for call in tool_calls]
+        )
+        self.append_tool_results(tool_calls, results_per_call)
@@ -0,0 +1,99 @@
+import logging
+import threading
+
+from agents.ansari import Ansari, build_context_window, build_tools
+
+logger = logging.getLogger(__name__)
+
+# Used when AB_TESTING_VARIANTS is not set: the original two system prompts
+DEFAULT_PROMPTS = ("system_msg_fn_v1", "system_msg_fn")
+
+
+class Variant:
+    """One arm of the experiment: a model id (as stored with votes), a system prompt and an LLM."""
+
+    __slots__ = ("model_id", "name", "prompt", "model")
+
+    def __init__(self, model_id: int, prompt: str, model: str, name: str = None):
+        self.model_id = model_id
+        self.prompt = prompt
+        self.model = model
+        self.name = name or f"{prompt}@{model}"
+
+
+class VariantRegistry:
+    """The experiment's variants, built into agents on first use.
+
+    Variants come from settings.AB_TESTING_VARIANTS (model id -> {"prompt",
+    "model", "name"}, all optional), or default to the two original prompts
+    under AB_TESTING_MODEL_1_ID and AB_TESTING_MODEL_2_ID. Agents are built
+    lazily, each from its own copy of the settings, and share one set of search
+    tools and one ContextWindow (with its token count cache) per LLM, so a
+    variant costs little more than its system prompt.
+    """
+
+    def __init__(self, settings, agent_class=Ansari):
+        self.settings = settings
+        self.agent_class = agent_class
+        self.variants = {}
+        for model_id, spec in (settings.AB_TESTING_VARIANTS or self.default_specs(settings)).items():
+            spec = spec or {}
+            prompt = spec.get("prompt", settings.SYSTEM_PROMPT_FILE_NAME)
+            model = spec.get("model", settings.MODEL)
+            # Named after the prompt alone unless the LLM differs from the default
+            name = spec.get("name") or (prompt if model == settings.MODEL else None)
+            self.variants[int(model_id)] = Variant(int(model_id), prompt, model, name)
+        self.agents = {}
+        self.context_windows = {}  # LLM -> ContextWindow
+        self._tools = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def default_specs(settings):
+        return {
+            settings.AB_TESTING_MODEL_1_ID: {"prompt": DEFAULT_PROMPTS[0]},
+            settings.AB_TESTING_MODEL_2_ID: {"prompt": DEFAULT_PROMPTS[1]},
+        }
+
+    def ids(self):
+        return list(self.variants)
+
+    @property
+    def tools(self):
+        with self.lock:
+            if self._tools is None:
+                self._tools = build_tools(self.settings)
+            return self._tools
+
+    def get(self, model_id: int):
+        """Returns the agent of a variant, building it on first use."""
+        agent = self.agents.get(model_id)
+        if agent is not None:
+            return agent
+        variant = self.variants[model_id]
+        tools = self.tools
+        with self.lock:
+            agent = self.agents.get(model_id)
+            if agent is None:
+                settings = self.settings.model_copy(
+                    update={"SYSTEM_PROMPT_FILE_NAME": variant.prompt, "MODEL": variant.model}
+                )
+                context_window = self.context_windows.get(variant.model)
+                if context_window is None:
+                    context_window = self.context_windows[variant.model] = build_context_window(settings)
+                agent = self.agents[model_id] = self.agent_class(
+                    settings, name=variant.name, tools=tools, context_window=context_window
+                )
+                logger.info(f"Built variant {model_id} ({variant.name}, {variant.model})")
+            return agent
+
+    def warm_up(self):
+        """Builds every variant, renders its system prompt and loads its tokenizer,
+        so the first conversations do not pay for it."""
+        for model_id in self.variants:
+            agent = self.get(model_id)
+            agent.sys_msg
+            agent.context_window.encoding
+
+    def label(self, model_id: int) -> str:
+        return f"Model {model_id} ({self.variants[model_id].name})"
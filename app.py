@@ -1,24 +1,31 @@
+import importlib
+import logging
 import os
-import copy
-import random
 import itertools
-from datetime import datetime, timezone
 
-import psycopg2
-from psycopg2.extras import Json
+from util.startup import startup, warm_up_in_background
+
 import gradio as gr
-from fastapi.responses import StreamingResponse
 
-from agents.ansari import Ansari
+from agents.ansari import Ansari, AsyncAnsari
+from agents.variants import VariantRegistry
 from config import get_settings
-
-# Two agents with two different system prompts
-settings_1 = get_settings()
-settings_1.SYSTEM_PROMPT_FILE_NAME = 'system_msg_fn_v1'
-agent_1 = Ansari(settings_1)
-settings_2 = get_settings()
-settings_2.SYSTEM_PROMPT_FILE_NAME = 'system_msg_fn'
-agent_2 = Ansari(settings_2)
+from util.metrics import start_metrics_server
+from util.pair_scheduler import PairScheduler
+from util.session_store import SessionStore, chat_pairs, drop_last_turn, new_session_id
+from util.vote_analytics import VoteAnalytics, format_results
+from util.streams import acoalesce_chunks, amerge_streams, coalesce_chunks, merge_streams
+from util.vote_writer import VoteWriter
+
+logger = logging.getLogger(__name__)
+startup.mark("imports")
+
+# The experiment's variants (AB_TESTING_VARIANTS, or the two original system prompts),
+# built on first use or by the warm-up once the server is up
+agent_class = AsyncAnsari if get_settings().ASYNC_ENGINE else Ansari
+variants = VariantRegistry(get_settings(), agent_class)
+# Favors pairs of variants whose order is still uncertain
+pair_scheduler = PairScheduler(variants.ids(), explore=get_settings().PAIR_EXPLORE)
 
 text_size = gr.themes.sizes.text_md
 # block_css = "block_css.css"
@@ -40,114 +47,213 @@ DB_CONFIG = {
 
 # Environment variables
 EXPERIMENT_ID = int(os.getenv('AB_TESTING_EXPERIMENT_ID', 1))
-MODEL_1_ID = int(os.getenv('AB_TESTING_MODEL_1_ID', 1))
-MODEL_2_ID = int(os.getenv('AB_TESTING_MODEL_2_ID', 2))
 
 # Global variable to store the current model assignment
 current_model_assignment = gr.State({})
 
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+# Votes are written in the background, in batches, over one connection
+vote_writer = VoteWriter(
+    DB_CONFIG,
+    max_queue=get_settings().VOTE_QUEUE_SIZE,
+    batch_size=get_settings().VOTE_BATCH_SIZE,
+    flush_interval=get_settings().VOTE_FLUSH_INTERVAL,
+    content_addressed=get_settings().CONTENT_ADDRESSED_CONVERSATIONS,
+    store_metrics=get_settings().STORE_TURN_METRICS,
+    experiment_id=EXPERIMENT_ID if get_settings().VOTE_AGGREGATES else None,
+)
+
+# Each browser session's conversation (both sides' full message histories, tool results
+# included) is kept here, so events do not send the chats back from the browser
+session_store = SessionStore(
+    max_sessions=get_settings().SESSION_STORE_MAX_SESSIONS,
+    max_bytes=get_settings().SESSION_STORE_MAX_BYTES,
+    idle_ttl=get_settings().SESSION_IDLE_TTL,
+)
+
+# Win rates and ratings for the Results tab, read from the running vote counts
+vote_analytics = VoteAnalytics(DB_CONFIG, EXPERIMENT_ID, samples=get_settings().VOTE_BOOTSTRAP_SAMPLES)
+
+def seed_pair_scheduler():
+    """Starts the scheduler from the experiment's stored vote counts, if they are kept."""
+    if not get_settings().VOTE_AGGREGATES:
+        return
+    try:
+        pair_scheduler.seed(vote_analytics.results()[0])
+    except Exception as e:
+        logger.warning(f"Could not load vote counts, pairs start uniform: {e}")
 
 def randomly_assign_models():
-    if random.choice([True, False]):
-        return {'A': MODEL_1_ID, 'B': MODEL_2_ID}
-    else:
-        return {'A': MODEL_2_ID, 'B': MODEL_1_ID}
-
-def insert_conversation(cursor, model_id, conversation):
-    cursor.execute(
-        "INSERT INTO ab_testing.ab_testing_conversations (model_id, conversation, timestamp) VALUES (%s, %s, %s) RETURNING conversation_id",
-        (model_id, Json(conversation), datetime.now(timezone.utc))
-    )
-    return cursor.fetchone()[0]
-
-def insert_comparison(cursor, model_a_id, model_b_id, conversation_a_id, conversation_b_id, user_vote):
-    cursor.execute(
-        "INSERT INTO ab_testing.ab_testing_comparisons (model_a_id, model_b_id, conversation_a_id, conversation_b_id, user_vote, timestamp) "
-        "VALUES (%s, %s, %s, %s, %s, %s)",
-        (model_a_id, model_b_id, conversation_a_id, conversation_b_id, user_vote, datetime.now(timezone.utc))
+    model_a_id, model_b_id = pair_scheduler.next_pair()
+    return {'A': model_a_id, 'B': model_b_id}
+
+def log_vote(vote, session_id, current_assignment, turn_metrics):
+    conversation = session_store.get(session_id)
+    if conversation is None:
+        gr.Warning("This conversation has expired, so the vote was not recorded.")
+        return
+    system_prompt_a = variants.get(current_assignment['A']).sys_msg
+    system_prompt_b = variants.get(current_assignment['B']).sys_msg
+    pair_scheduler.record(current_assignment['A'], current_assignment['B'], vote)
+    vote_writer.submit(
+        current_assignment['A'],
+        current_assignment['B'],
+        [system_prompt_a] + chat_pairs(conversation['A']['history']),
+        [system_prompt_b] + chat_pairs(conversation['B']['history']),
+        vote,
+        metrics=dict(turn_metrics) if turn_metrics else None,
     )
 
-def log_vote(right_chat_history, left_chat_history, vote, current_assignment):
-    try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                # Insert conversations
-                system_prompt_a = agent_1.sys_msg if current_assignment['A'] == MODEL_1_ID else agent_2.sys_msg
-                system_prompt_b = agent_2.sys_msg if current_assignment['B'] == MODEL_2_ID else agent_1.sys_msg
-                conv_a_id = insert_conversation(cur, current_assignment['A'], [system_prompt_a] + left_chat_history)
-                conv_b_id = insert_conversation(cur, current_assignment['B'], [system_prompt_b] + right_chat_history)
-
-                # Insert comparison
-                insert_comparison(cur, current_assignment['A'], current_assignment['B'], conv_a_id, conv_b_id, vote)
-
-            conn.commit()
-    except psycopg2.Error as e:
-        print(f"Database error: {e}")
-
-def left_vote_last_response(right_chat_history, left_chat_history, current_assignment):
-    log_vote(right_chat_history, left_chat_history, "A", current_assignment)
+def left_vote_last_response(session_id, current_assignment, turn_metrics):
+    log_vote("A", session_id, current_assignment, turn_metrics)
     return disable_buttons(4)
 
-def right_vote_last_response(right_chat_history, left_chat_history, current_assignment):
-    log_vote(right_chat_history, left_chat_history, "B", current_assignment)
+def right_vote_last_response(session_id, current_assignment, turn_metrics):
+    log_vote("B", session_id, current_assignment, turn_metrics)
     return disable_buttons(4)
 
-def tie_vote_last_response(right_chat_history, left_chat_history, current_assignment):
-    log_vote(right_chat_history, left_chat_history, "Tie", current_assignment)
+def tie_vote_last_response(session_id, current_assignment, turn_metrics):
+    log_vote("Tie", session_id, current_assignment, turn_metrics)
     return disable_buttons(4)
 
-def bothbad_vote_last_response(right_chat_history, left_chat_history, current_assignment):
-    log_vote(right_chat_history, left_chat_history, "Both Bad", current_assignment)
+def bothbad_vote_last_response(session_id, current_assignment, turn_metrics):
+    log_vote("Both Bad", session_id, current_assignment, turn_metrics)
     return disable_buttons(4)
 
-def clear_conversation():
+def clear_conversation(session_id):
+    session_store.discard(session_id)
     new_assignment = randomly_assign_models()
-    return (new_assignment,) + tuple([None] * 3 + [gr.Button(interactive=False, visible=True)]*6)
-
-def gr_chat_format_to_openai_chat_format(user_message, chat_history):
-    openai_chat_history = []
-    for human, assistant in chat_history:
-        openai_chat_history.append({"role": "user", "content": human})
-        openai_chat_history.append({"role": "assistant", "content": assistant})
-    openai_chat_history.append({"role": "user", "content": user_message})
-    return openai_chat_history
-
-def handle_chat(user_message, chat_history, model_id):
-    agent = copy.deepcopy(agent_1 if model_id == MODEL_1_ID else agent_2)
-    openai_chat_history = gr_chat_format_to_openai_chat_format(user_message, chat_history)
-    return agent.replace_message_history(openai_chat_history)
-
-def handle_user_message(user_message, right_chat_history, left_chat_history, current_assignment):
+    return (new_assignment, {}, new_session_id()) + tuple([None] * 3 + [gr.Button(interactive=False, visible=True)]*6)
+
+def load_conversation(session_id, turn_metrics):
+    """Returns the stored conversation, or an empty one if it is new or has expired."""
+    conversation = session_store.get(session_id)
+    if conversation is None:
+        if turn_metrics:
+            gr.Warning("This conversation has expired, so its earlier turns are forgotten.")
+        conversation = {side: {"history": []} for side in ("A", "B")}
+    return conversation
+
+def save_conversation(session_id, right_session, left_session):
+    session_store.put(session_id, {
+        side: {"history": session.message_history[1:]}
+        for side, session in (("B", right_session), ("A", left_session))
+    })
+
+def handle_chat(user_message, stored, model_id, session_id):
+    """Returns a session for the model, resumed from its stored side of the
+    conversation, and the stream of its reply. Upstream calls are queued fairly
+    per browser session (see util.admission)."""
+    session = variants.get(model_id).new_session(client=session_id)
+    session.resume(stored["history"])
+    return session, session.process_input(user_message)
+
+def record_turn_metrics(turn_metrics, turn, right_session, left_session):
+    """Stores each side's metrics for the given turn, dropping those of later
+    turns (which a regenerate replaces)."""
+    for side, session in (("B", right_session), ("A", left_session)):
+        turn_metrics[side] = turn_metrics.get(side, [])[:turn] + [session.turn_metrics()]
+
+def stream_both(right_chat_response, left_chat_response):
+    """Yields (side, chunk) pairs, side 0 being the right chat and 1 the left.
+
+    In concurrent mode each side runs in its own worker, so a tool call or retry
+    on one side does not stall the other side's tokens.
+    """
+    if not get_settings().CONCURRENT_STREAMS:
+        for right_chunk, left_chunk in itertools.zip_longest(right_chat_response, left_chat_response, fillvalue=None):
+            if right_chunk is not None:
+                yield 0, right_chunk
+            if left_chunk is not None:
+                yield 1, left_chunk
+        return
+    yield from merge_streams(right_chat_response, left_chat_response, idle_tick=get_settings().STREAM_COALESCE_INTERVAL or None)
+
+def append_chunks(batch, right_chat_history, left_chat_history):
+    for side, text in batch.items():
+        chat_history = right_chat_history if side == 0 else left_chat_history
+        chat_history[-1][1] += text
+
+def handle_user_message(user_message, session_id, current_assignment, turn_metrics):
     if not user_message.strip():
-        yield user_message, right_chat_history, left_chat_history, *keep_unchanged_buttons()
+        yield user_message, gr.update(), gr.update(), *keep_unchanged_buttons()
     else:
-        right_chat_response = handle_chat(user_message, right_chat_history, current_assignment['B'])
-        left_chat_response = handle_chat(user_message, left_chat_history, current_assignment['A'])
+        conversation = load_conversation(session_id, turn_metrics)
+        right_chat_history = chat_pairs(conversation['B']['history'])
+        left_chat_history = chat_pairs(conversation['A']['history'])
+        right_session, right_chat_response = handle_chat(user_message, conversation['B'], current_assignment['B'], session_id)
+        left_session, left_chat_response = handle_chat(user_message, conversation['A'], current_assignment['A'], session_id)
+        turn = len(right_chat_history)
 
         right_chat_history.append([user_message, ""])
         left_chat_history.append([user_message, ""])
+        # Buttons are only sent when their state changes
+        yield "", right_chat_history, left_chat_history, *disable_buttons()
+
+        chunks = stream_both(right_chat_response, left_chat_response)
+        for batch in coalesce_chunks(chunks, get_settings().STREAM_COALESCE_INTERVAL, get_settings().STREAM_COALESCE_CHARS):
+            append_chunks(batch, right_chat_history, left_chat_history)
+            yield "", right_chat_history, left_chat_history, *keep_unchanged_buttons()
+        save_conversation(session_id, right_session, left_session)
+        record_turn_metrics(turn_metrics, turn, right_session, left_session)
+        yield "", right_chat_history, left_chat_history, *enable_buttons()
 
-        for right_chunk, left_chunk in itertools.zip_longest(right_chat_response, left_chat_response, fillvalue=None):
-            if right_chunk:
-                right_content = right_chunk#.choices[0].delta.content
-                if right_content:
-                    right_chat_history[-1][1] += right_content
-            if left_chunk:
-                left_content = left_chunk#.choices[0].delta.content
-                if left_content:
-                    left_chat_history[-1][1] += left_content
-
-            yield "", right_chat_history, left_chat_history, *disable_buttons()
+async def ahandle_user_message(user_message, session_id, current_assignment, turn_metrics):
+    if not user_message.strip():
+        yield user_message, gr.update(), gr.update(), *keep_unchanged_buttons()
+    else:
+        conversation = load_conversation(session_id, turn_metrics)
+        right_chat_history = chat_pairs(conversation['B']['history'])
+        left_chat_history = chat_pairs(conversation['A']['history'])
+        right_session, right_chat_response = handle_chat(user_message, conversation['B'], current_assignment['B'], session_id)
+        left_session, left_chat_response = handle_chat(user_message, conversation['A'], current_assignment['A'], session_id)
+        turn = len(right_chat_history)
+
+        right_chat_history.append([user_message, ""])
+        left_chat_history.append([user_message, ""])
+        yield "", right_chat_history, left_chat_history, *disable_buttons()
+
+        chunks = amerge_streams(right_chat_response, left_chat_response, idle_tick=get_settings().STREAM_COALESCE_INTERVAL or None)
+        async for batch in acoalesce_chunks(chunks, get_settings().STREAM_COALESCE_INTERVAL, get_settings().STREAM_COALESCE_CHARS):
+            append_chunks(batch, right_chat_history, left_chat_history)
+            yield "", right_chat_history, left_chat_history, *keep_unchanged_buttons()
+        save_conversation(session_id, right_session, left_session)
+        record_turn_metrics(turn_metrics, turn, right_session, left_session)
         yield "", right_chat_history, left_chat_history, *enable_buttons()
 
-def regenerate(right_chat_history, left_chat_history, current_assignment):
-    for result in handle_user_message(right_chat_history[-1][0], right_chat_history[:-1], left_chat_history[:-1], current_assignment):
+def drop_last_turn_of(session_id):
+    """Removes the last turn from both sides of the stored conversation and returns its user message."""
+    conversation = session_store.get(session_id)
+    if conversation is None:
+        return None
+    user_message = None
+    for stored in conversation.values():
+        stored["history"], user_message = drop_last_turn(stored["history"])
+    session_store.put(session_id, conversation)
+    return user_message
+
+def regenerate(session_id, current_assignment, turn_metrics):
+    user_message = drop_last_turn_of(session_id)
+    if user_message is None:
+        yield "", gr.update(), gr.update(), *keep_unchanged_buttons()
+        return
+    for result in handle_user_message(user_message, session_id, current_assignment, turn_metrics):
         yield result
 
+async def aregenerate(session_id, current_assignment, turn_metrics):
+    user_message = drop_last_turn_of(session_id)
+    if user_message is None:
+        yield "", gr.update(), gr.update(), *keep_unchanged_buttons()
+        return
+    async for result in ahandle_user_message(user_message, session_id, current_assignment, turn_metrics):
+        yield result
+
+if get_settings().ASYNC_ENGINE:
+    message_handler, regenerate_handler = ahandle_user_message, aregenerate
+else:
+    message_handler, regenerate_handler = handle_user_message, regenerate
+
 def keep_unchanged_buttons():
-    return tuple([gr.Button() for _ in range(6)])
+    return tuple([gr.update() for _ in range(6)])
 
 def enable_buttons():
     return tuple([gr.Button(interactive=True, visible=True) for _ in range(6)])
@@ -210,67 +316,107 @@ def create_compare_performance_tab():
         ]
         leftvote_btn.click(
             left_vote_last_response,
-            [right_chat_dialog, left_chat_dialog, current_model_assignment],
+            [session_id_state, current_model_assignment, turn_metrics_state],
             [leftvote_btn, rightvote_btn, tie_btn, bothbad_btn],
         )
         rightvote_btn.click(
             right_vote_last_response,
-            [right_chat_dialog, left_chat_dialog, current_model_assignment],
+            [session_id_state, current_model_assignment, turn_metrics_state],
             [leftvote_btn, rightvote_btn, tie_btn, bothbad_btn],
         )
         tie_btn.click(
             tie_vote_last_response,
-            [right_chat_dialog, left_chat_dialog, current_model_assignment],
+            [session_id_state, current_model_assignment, turn_metrics_state],
             [leftvote_btn, rightvote_btn, tie_btn, bothbad_btn],
         )
         bothbad_btn.click(
             bothbad_vote_last_response,
-            [right_chat_dialog, left_chat_dialog, current_model_assignment],
+            [session_id_state, current_model_assignment, turn_metrics_state],
             [leftvote_btn, rightvote_btn, tie_btn, bothbad_btn],
         )
         clear_btn.click(
             clear_conversation,
-            None,
-            [current_model_assignment, user_msg_textbox, right_chat_dialog, left_chat_dialog] + btn_list,
+            [session_id_state],
+            [current_model_assignment, turn_metrics_state, session_id_state, user_msg_textbox, right_chat_dialog, left_chat_dialog] + btn_list,
         )
 
         user_msg_textbox.submit(
-            handle_user_message,
-            [user_msg_textbox, right_chat_dialog, left_chat_dialog, current_model_assignment],
+            message_handler,
+            [user_msg_textbox, session_id_state, current_model_assignment, turn_metrics_state],
             [user_msg_textbox, right_chat_dialog, left_chat_dialog] + btn_list,
         )
 
         send_btn.click(
-            handle_user_message,
-            [user_msg_textbox, right_chat_dialog, left_chat_dialog, current_model_assignment],
+            message_handler,
+            [user_msg_textbox, session_id_state, current_model_assignment, turn_metrics_state],
             [user_msg_textbox, right_chat_dialog, left_chat_dialog] + btn_list,
         )
 
         regenerate_btn.click(
-            regenerate, 
-            [right_chat_dialog, left_chat_dialog, current_model_assignment],
+            regenerate_handler,
+            [session_id_state, current_model_assignment, turn_metrics_state],
             [user_msg_textbox, right_chat_dialog, left_chat_dialog] + btn_list
         )
 
+def variant_label(model_id):
+    return variants.label(model_id) if model_id in variants.variants else f"Model {model_id}"
+
+def load_results():
+    try:
+        results = vote_analytics.results()
+    except Exception as e:
+        return f"Could not load results: {e}"
+    return format_results(results, variant_label)
+
+def create_results_tab():
+    with gr.Tab("📊 Results", id=2) as results_tab:
+        results_markdown = gr.Markdown("Loading...", elem_id="results_markdown")
+        refresh_btn = gr.Button(value="🔄 Refresh", scale=0)
+        results_tab.select(load_results, None, results_markdown)
+        refresh_btn.click(load_results, None, results_markdown)
+
 def create_about_tab():
     with gr.Tab("🛈 About Us", id=1):
         about_markdown = "This UI is designed to test a change to Ansari's functionality before deployment"
         gr.Markdown(about_markdown, elem_id="about_markdown")
 
-with gr.Blocks(
+def warm_up():
+    """Prepares, in the background, what the first conversations would otherwise wait for."""
+    return warm_up_in_background(
+        ("import litellm", lambda: importlib.import_module("litellm")),
+        ("build variants", variants.warm_up),
+        ("seed pair scheduler", seed_pair_scheduler),
+    )
+
+with startup.phase("build UI"), gr.Blocks(
     title="Ansari Compare",
     theme=gr.themes.Soft(text_size=text_size,
                           primary_hue=gr.themes.colors.sky, secondary_hue=gr.themes.colors.blue),
     #css=block_css,
 ) as gr_app:
-    current_model_assignment = gr.State(randomly_assign_models())
+    # Drawn from the pair scheduler on each page load, not once for every browser
+    current_model_assignment = gr.State(randomly_assign_models)
+    # Per-turn metrics of each side, {"A": [...], "B": [...]}, stored with the vote
+    turn_metrics_state = gr.State({})
+    # Key of this browser session's conversation in session_store
+    session_id_state = gr.State(new_session_id)
     with gr.Tabs() as tabs:
         create_compare_performance_tab()
+        if get_settings().VOTE_AGGREGATES:
+            create_results_tab()
         create_about_tab()
 
 if __name__ == "__main__":
+    if get_settings().METRICS_PORT:
+        start_metrics_server(get_settings().METRICS_PORT)
     gr_app.queue(
             default_concurrency_limit=10,
             status_update_rate=10,
             api_open=False,
-        ).launch(server_port=7860, max_threads=200, show_api=False)
+        ).launch(server_port=7860, max_threads=200, show_api=False, prevent_thread_lock=True)
+    startup.mark("port open")
+    if get_settings().WARM_UP_ON_START:
+        warm_up()
+    else:
+        seed_pair_scheduler()
+    gr_app.block_thread()
@@ -0,0 +1,118 @@
+"""Latency of light users next to a heavy one, with and without admission control.
+
+Simulates an upstream that serves `--capacity` concurrent calls and answers
+any call beyond that with HTTP 429. One heavy client sends `--heavy` calls at
+once while `--light` clients each send one call at a random time in the
+first `--spread` seconds. Failed calls are retried with the app's RetryPolicy. Modes:
+
+    none   calls go straight to the upstream; 429s are retried with backoff
+    fifo   one AdmissionLimiter queue for everyone (first come, first served)
+    fair   AdmissionLimiter with a queue per client, served round-robin
+
+    python -m benchmarks.bench_admission --heavy 60 --light 20 --capacity 4
+"""
+
+import argparse
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from util.admission import AdmissionLimiter
+from util.retry import Deadline, RetryPolicy
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class Upstream:
+    def __init__(self, capacity, service_time):
+        self.capacity = capacity
+        self.service_time = service_time
+        self.active = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def call(self):
+        with self.lock:
+            if self.active >= self.capacity:
+                self.rejected += 1
+                raise RateLimited("429 Too Many Requests")
+            self.active += 1
+        time.sleep(self.service_time)
+        with self.lock:
+            self.active -= 1
+
+
+def run(mode, args, seed):
+    rng = random.Random(seed)
+    upstream = Upstream(args.capacity, args.service_time)
+    limiter = AdmissionLimiter(mode, concurrency=args.capacity) if mode != "none" else None
+    retry = RetryPolicy(args.attempts, 0.5, 8.0)
+    latencies = {"heavy": [], "light": []}
+    failures = [0]
+    lock = threading.Lock()
+
+    def call(kind, client, delay):
+        time.sleep(delay)
+        start = time.monotonic()
+        deadline = Deadline(args.deadline)
+        fn = upstream.call
+        if limiter is not None:
+            fn = limiter.wrap(fn, client if mode == "fair" else None, deadline)
+        try:
+            retry.call(fn, deadline=deadline)
+        except Exception:
+            with lock:
+                failures[0] += 1
+            return
+        with lock:
+            latencies[kind].append(time.monotonic() - start)
+
+    calls = [("heavy", "heavy", 0.0)] * args.heavy
+    calls += [("light", f"light-{i}", rng.uniform(0, args.spread)) for i in range(args.light)]
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        list(pool.map(lambda c: call(*c), calls))
+    return latencies, failures[0], upstream.rejected, time.monotonic() - start
+
+
+def quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--heavy", type=int, default=60, help="calls the heavy client sends at once")
+    parser.add_argument("--light", type=int, default=20, help="light clients, one call each")
+    parser.add_argument("--spread", type=float, default=2.0, help="seconds over which light calls arrive")
+    parser.add_argument("--capacity", type=int, default=4, help="concurrent calls the upstream accepts")
+    parser.add_argument("--service-time", type=float, default=0.2)
+    parser.add_argument("--attempts", type=int, default=5, help="retry attempts per call")
+    parser.add_argument("--deadline", type=float, default=30.0, help="seconds per call, queueing included")
+    parser.add_argument("--trials", type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger("util.retry").setLevel(logging.ERROR)
+
+    print(f"{'mode':<6} {'light p50':>9} {'light p95':>9} {'heavy p95':>9} {'429s':>6} {'failed':>6} {'total s':>8}")
+    for mode in ("none", "fifo", "fair"):
+        light, heavy, rejected, failed, total = [], [], [], [], []
+        for seed in range(args.trials):
+            latencies, failures, rejections, elapsed = run(mode, args, seed)
+            light.extend(latencies["light"])
+            heavy.extend(latencies["heavy"])
+            rejected.append(rejections)
+            failed.append(failures)
+            total.append(elapsed)
+        print(
+            f"{mode:<6} {quantile(light, 0.5):>9.2f} {quantile(light, 0.95):>9.2f} {quantile(heavy, 0.95):>9.2f} "
+            f"{statistics.mean(rejected):>6.0f} {statistics.mean(failed):>6.1f} {statistics.mean(total):>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
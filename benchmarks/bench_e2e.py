@@ -0,0 +1,235 @@
+"""End-to-end latency and throughput of the comparison app, fully offline.
+
+Drives `app.handle_user_message` (or its async twin when ASYNC_ENGINE is set)
+for N concurrent simulated users, each sending several messages to both
+agents. OpenAI, Kalimat and Vectara are replaced by the stand-ins in
+benchmarks.stubs; no votes are cast, so Postgres is never contacted. Reports
+p50/p95/p99 time to first token (per side) and turn time, plus peak threads
+and memory, and appends the result, tagged with the current commit, to
+benchmarks/results/e2e.jsonl so regressions across commits are visible.
+
+    python -m benchmarks.bench_e2e --users 20 --turns 3
+    python -m benchmarks.bench_e2e --history 10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks.stubs import StubLLM, StubSearchServer
+from util import hedge
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results", "e2e.jsonl")
+
+# Settings the app requires; the stubs never check them
+PLACEHOLDER_ENV = {
+    "OPENAI_API_KEY": "bench",
+    "KALEMAT_API_KEY": "bench",
+    "VECTARA_AUTH_TOKEN": "bench",
+    "VECTARA_CUSTOMER_ID": "bench",
+    "VECTARA_CORPUS_ID": "bench",
+    "AB_TESTING_DB_NAME": "bench",
+    "AB_TESTING_DB_USER": "bench",
+    "AB_TESTING_DB_PASSWORD": "bench",
+    "AB_TESTING_DB_HOST": "localhost",
+    "AB_TESTING_DB_PORT": "5432",
+    "AB_TESTING_EXPERIMENT_ID": "1",
+    "AB_TESTING_MODEL_1_ID": "1",
+    "AB_TESTING_MODEL_2_ID": "2",
+    "template_dir": os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources", "prompts"),
+}
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "n": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "n": len(values)}
+
+
+class Recorder:
+    """Collects per-turn timings from all simulated users."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ttft = []
+        self.turn = []
+        self.errors = 0
+
+    def observe(self, start, updates):
+        """Takes the (time, right answer, left answer) of each update of one turn."""
+        firsts = [next((t for t, *answers in updates if answers[side]), None) for side in (0, 1)]
+        with self.lock:
+            self.ttft.extend(t - start for t in firsts if t is not None)
+            self.turn.append(updates[-1][0] - start)
+
+
+def user_messages(user, turns):
+    return [f"user {user} question {turn} about prayer" for turn in range(turns)]
+
+
+def run_user(app, recorder, user, turns):
+    session_id, metrics = app.new_session_id(), {}
+    assignment = app.randomly_assign_models()
+    for message in user_messages(user, turns):
+        start = time.perf_counter()
+        updates = []
+        try:
+            for _, right, left, *_ in app.handle_user_message(message, session_id, assignment, metrics):
+                updates.append((time.perf_counter(), right[-1][1], left[-1][1]))
+        except Exception:
+            logging.exception(f"user {user} failed")
+            with recorder.lock:
+                recorder.errors += 1
+            return
+        recorder.observe(start, updates)
+
+
+async def arun_user(app, recorder, user, turns):
+    session_id, metrics = app.new_session_id(), {}
+    assignment = app.randomly_assign_models()
+    for message in user_messages(user, turns):
+        start = time.perf_counter()
+        updates = []
+        try:
+            async for _, right, left, *_ in app.ahandle_user_message(message, session_id, assignment, metrics):
+                updates.append((time.perf_counter(), right[-1][1], left[-1][1]))
+        except Exception:
+            logging.exception(f"user {user} failed")
+            recorder.errors += 1
+            return
+        recorder.observe(start, updates)
+
+
+def sample_threads(stop, peak):
+    while not stop.wait(0.05):
+        peak[0] = max(peak[0], threading.active_count())
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def show_history(n):
+    if not os.path.exists(RESULTS_PATH):
+        print("No results yet")
+        return
+    with open(RESULTS_PATH) as f:
+        rows = [json.loads(line) for line in f if line.strip()][-n:]
+    print(f"{'commit':<10} {'mode':<6} {'users':>5} {'ttft p50':>9} {'ttft p95':>9} {'turn p50':>9} {'turn p95':>9} {'threads':>7} {'rss MB':>7}")
+    for r in rows:
+        print(
+            f"{r['commit'] or '-':<10} {r['mode']:<6} {r['params']['users']:>5} "
+            f"{r['ttft']['p50']:>9} {r['ttft']['p95']:>9} {r['turn']['p50']:>9} {r['turn']['p95']:>9} "
+            f"{r['peak_threads']:>7} {r['max_rss_mb']:>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=3, help="messages per user")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="seconds")
+    parser.add_argument("--answer-tokens", type=int, default=150)
+    parser.add_argument("--function-call-rate", type=float, default=0.8)
+    parser.add_argument("--search-latency", type=float, default=0.15, help="seconds")
+    parser.add_argument("--search-error-rate", type=float, default=0.0)
+    parser.add_argument("--search-tail-rate", type=float, default=0.0, help="share of very slow searches")
+    parser.add_argument("--search-tail-latency", type=float, default=2.0, help="seconds")
+    parser.add_argument("--no-save", action="store_true", help="do not append to the results file")
+    parser.add_argument("--history", type=int, metavar="N", help="show the last N stored results and exit")
+    args = parser.parse_args()
+
+    if args.history:
+        show_history(args.history)
+        return
+
+    for key, value in PLACEHOLDER_ENV.items():
+        os.environ.setdefault(key, value)
+    # Retries of injected errors should not dominate the run
+    os.environ.setdefault("MAX_FAILURES", "3")
+
+    llm = StubLLM(args.tokens_per_second, args.first_token_latency, args.answer_tokens, args.function_call_rate)
+    llm.install()
+    search = StubSearchServer(
+        args.search_latency,
+        error_rate=args.search_error_rate,
+        tail_rate=args.search_tail_rate,
+        tail_latency=args.search_tail_latency,
+    ).start()
+
+    import app
+
+    logging.getLogger("agents.ansari.Ansari").setLevel(logging.WARNING)
+    search.point_tools(app.variants)
+    # Cold start is measured by bench_startup; time the steady state here
+    app.variants.warm_up()
+    mode = "async" if app.get_settings().ASYNC_ENGINE else "sync"
+
+    recorder = Recorder()
+    peak_threads = [threading.active_count()]
+    stop = threading.Event()
+    threading.Thread(target=sample_threads, args=(stop, peak_threads), daemon=True).start()
+
+    start = time.perf_counter()
+    if mode == "async":
+
+        async def run_all():
+            await asyncio.gather(*[arun_user(app, recorder, u, args.turns) for u in range(args.users)])
+
+        asyncio.run(run_all())
+    else:
+        with ThreadPoolExecutor(args.users) as pool:
+            list(pool.map(lambda u: run_user(app, recorder, u, args.turns), range(args.users)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+
+    result = {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "mode": mode,
+        "params": {k: v for k, v in vars(args).items() if k not in ("no_save", "history")},
+        "elapsed_seconds": round(elapsed, 3),
+        "turns_per_second": round(len(recorder.turn) / elapsed, 3),
+        "errors": recorder.errors,
+        "ttft": percentiles(recorder.ttft),
+        "turn": percentiles(recorder.turn),
+        "peak_threads": peak_threads[0],
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "llm_calls": llm.calls,
+        "search_requests": search.requests,
+        "search_errors": search.errors,
+        "hedges_fired": sum(hedge.hedges_fired.series.values()),
+        "hedges_won": sum(hedge.hedges_won.series.values()),
+    }
+    search.shutdown()
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Measures connection reuse in the tool HTTP path against a local stub server.
+
+Runs the same number of Kalimat-style GET requests once with bare `requests.get`
+(a new connection per call, as the tools used to do) and once through the
+pooled HttpClient, and reports wall time and the number of TCP connections the
+stub server accepted.
+
+    python -m benchmarks.bench_http_pool --requests 500 --threads 8
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from util.http_client import HttpClient
+
+
+class CountingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps([{"id": "1:1", "text": "...", "en_text": "..."}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(get, url, n_requests, n_threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n_threads) as pool:
+        list(pool.map(lambda i: get(url, params={"query": f"q{i}"}).json(), range(n_requests)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--pool-maxsize", type=int, default=20)
+    args = parser.parse_args()
+
+    server = CountingServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/search"
+
+    elapsed = run(requests.get, url, args.requests, args.threads)
+    print(f"unpooled: {elapsed:.3f}s, {server.connections} connections")
+
+    server.connections = 0
+    client = HttpClient(pool_maxsize=args.pool_maxsize)
+    elapsed = run(client.get, url, args.requests, args.threads)
+    print(f"pooled:   {elapsed:.3f}s, {server.connections} connections")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
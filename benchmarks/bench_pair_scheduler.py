@@ -0,0 +1,63 @@
+"""Votes needed to rank K variants, with uniform versus adaptive pair sampling.
+
+Simulates votes between variants whose true Bradley-Terry ratings are `--gap`
+Elo points apart, with a share of ties. Each conversation compares the pair
+picked by util.pair_scheduler.PairScheduler (adaptive) or a uniformly random
+pair, and the run stops once every pair's order is significant (its ranking
+uncertainty is below --alpha). Every vote costs one conversation, i.e. two LLM
+answers, so fewer votes means proportionally fewer LLM calls.
+
+    python -m benchmarks.bench_pair_scheduler --variants 4 --gap 60 --trials 20
+"""
+
+import argparse
+import random
+import statistics
+
+from util.pair_scheduler import PairScheduler, ranking_uncertainty
+
+
+def simulate(variants, gap, tie_rate, alpha, adaptive, seed, max_votes):
+    """Returns (votes until every pair is decided, whether all decided orders are correct)."""
+    rng = random.Random(seed)
+    ratings = {i: -gap * i for i in range(variants)}
+    scheduler = PairScheduler(range(variants), seed=seed)
+    for votes in range(1, max_votes + 1):
+        a, b = scheduler.next_pair() if adaptive else rng.sample(range(variants), 2)
+        p_a = 1 / (1 + 10 ** ((ratings[b] - ratings[a]) / 400))
+        if rng.random() < tie_rate:
+            vote = "Tie"
+        else:
+            vote = "A" if rng.random() < p_a else "B"
+        scheduler.record(a, b, vote)
+        if votes % 10 == 0 and all(ranking_uncertainty(*c) < alpha for c in scheduler.counts.values()):
+            break
+    correct = all(c[0] > c[1] for c in scheduler.counts.values())  # lower id is better
+    return votes, correct
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--variants", type=int, default=4)
+    parser.add_argument("--gap", type=float, default=60.0, help="Elo points between neighbouring variants")
+    parser.add_argument("--tie-rate", type=float, default=0.15)
+    parser.add_argument("--alpha", type=float, default=0.025, help="uncertainty below which a pair is decided")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--max-votes", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"{'sampling':<10} {'median votes':>12} {'p90 votes':>10} {'correct':>8}")
+    for label, adaptive in (("uniform", False), ("adaptive", True)):
+        runs = [
+            simulate(args.variants, args.gap, args.tie_rate, args.alpha, adaptive, seed, args.max_votes)
+            for seed in range(args.trials)
+        ]
+        votes = sorted(v for v, _ in runs)
+        print(
+            f"{label:<10} {statistics.median(votes):>12.0f} {votes[int(0.9 * (len(votes) - 1))]:>10} "
+            f"{sum(c for _, c in runs) / len(runs):>8.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
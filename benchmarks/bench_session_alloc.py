@@ -0,0 +1,50 @@
+"""Compares the per-message cost of copying an agent with creating a session.
+
+app.handle_chat used to `copy.deepcopy` the whole Ansari agent (tools, PromptMgr,
+function schemas, system prompt) for every user message; it now calls
+`new_session()`. This reports time and bytes allocated per request for both.
+Needs the same environment variables as the app (see config.Settings).
+
+    python -m benchmarks.bench_session_alloc --iterations 1000
+"""
+
+import argparse
+import copy
+import time
+import tracemalloc
+
+from agents.ansari import Ansari
+from config import get_settings
+
+
+def measure(label, make, iterations):
+    tracemalloc.start()
+    start = time.perf_counter()
+    # Keep the objects alive so their allocations are counted, as they are
+    # while a conversation is being served.
+    kept = [make() for _ in range(iterations)]
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<12} {elapsed / iterations * 1e6:9.1f} us/request "
+        f"{current / iterations:10.0f} bytes/request"
+    )
+    return kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    agent = Ansari(get_settings())
+    # The process-wide HTTP client and tool cache hold locks and cannot be
+    # copied; share them, as the agent did not have them when it was deep-copied.
+    shared = {agent.tool_cache, next(iter(agent.tools.values())).http}
+    measure("deepcopy", lambda: copy.deepcopy(agent, {id(x): x for x in shared}), args.iterations)
+    measure("new_session", agent.new_session, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Cold-start profile of the comparison app: import time by package and startup phases.
+
+Imports `app` in fresh interpreters under `python -X importtime`, with the same
+placeholder settings as bench_e2e (nothing is contacted), and reports the wall
+time to import it, the packages that took longest to import (self time, summed
+per top-level package) and the phases recorded by util.startup. The median run
+is appended, tagged with the current commit, to benchmarks/results/startup.jsonl.
+With --budget the exit status is 1 if importing app took longer, so a CI job
+can catch startup regressions.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --budget 4.0
+    python -m benchmarks.bench_startup --history 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from benchmarks.bench_e2e import PLACEHOLDER_ENV, current_commit
+from util.startup import format_events
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results", "startup.jsonl")
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+from util.startup import startup
+print(json.dumps({"import_seconds": time.perf_counter() - start, "phases": startup.as_list()}))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Sums `-X importtime` self times (seconds) per top-level package."""
+    totals = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        totals[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return dict(totals)
+
+
+def profile_once() -> dict:
+    env = dict(PLACEHOLDER_ENV, **os.environ)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing app failed:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["packages"] = parse_importtime(proc.stderr)
+    return result
+
+
+def show_history(n):
+    if not os.path.exists(RESULTS_PATH):
+        print("No results yet")
+        return
+    with open(RESULTS_PATH) as f:
+        rows = [json.loads(line) for line in f if line.strip()][-n:]
+    print(f"{'commit':<10} {'import s':>9}  slowest packages")
+    for r in rows:
+        slowest = ", ".join(f"{name} {s:.2f}" for name, s in list(r["packages"].items())[:3])
+        print(f"{r['commit'] or '-':<10} {r['import_seconds']:>9.3f}  {slowest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to profile; the median is kept")
+    parser.add_argument("--top", type=int, default=15, help="packages to list")
+    parser.add_argument("--budget", type=float, help="fail if importing app takes longer (seconds)")
+    parser.add_argument("--no-save", action="store_true", help="do not append to the results file")
+    parser.add_argument("--history", type=int, metavar="N", help="show the last N stored results and exit")
+    args = parser.parse_args()
+
+    if args.history:
+        show_history(args.history)
+        return
+
+    runs = sorted((profile_once() for _ in range(args.runs)), key=lambda r: r["import_seconds"])
+    median = runs[len(runs) // 2]
+    packages = sorted(median["packages"].items(), key=lambda item: item[1], reverse=True)[: args.top]
+
+    print(f"import app: {median['import_seconds']:.3f}s (median of {len(runs)}, "
+          f"range {runs[0]['import_seconds']:.3f}-{runs[-1]['import_seconds']:.3f}s)")
+    print("\nslowest packages (self time):")
+    for name, seconds in packages:
+        print(f"  {seconds * 1000:9.1f} ms  {name}")
+    print("\nstartup phases (end time since util.startup was imported, duration):")
+    print(format_events(median["phases"]))
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, "a") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "commit": current_commit(),
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                        "import_seconds": round(median["import_seconds"], 4),
+                        "import_seconds_runs": [round(r["import_seconds"], 4) for r in runs],
+                        "packages": {name: round(s, 4) for name, s in packages},
+                        "phases": median["phases"],
+                    }
+                )
+                + "\n"
+            )
+
+    if args.budget is not None and median["import_seconds"] > args.budget:
+        print(f"\nimport app took {median['import_seconds']:.3f}s, over the {args.budget}s budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Local stand-ins for the services the app talks to, for offline benchmarks.
+
+`StubLLM` replaces `litellm.completion`/`acompletion` with a generator that
+streams at a configurable token rate and asks for a tool call on the first round
+of a turn. `StubSearchServer` serves Kalimat-style `GET /search` and
+Vectara-style `POST /v1/query` on localhost, with injected latency and errors.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+TOOL_NAMES = ("search_quran", "search_hadith", "search_mawsuah")
+
+
+class Obj:
+    """Attribute and item access, like litellm's streaming delta objects."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
+
+def chunk(content=None, function_call=None, tool_calls=None):
+    return Obj(choices=[Obj(delta=Obj(content=content, function_call=function_call, tool_calls=tool_calls))])
+
+
+class StubLLM:
+    """A fake streaming LLM.
+
+    On the first round of a turn (no tool results after the last user message)
+    it requests a tool call with probability `function_call_rate`, using the
+    legacy `functions` or the `tools` format depending on what the request
+    offered, and the user's message as the query. Otherwise it streams an
+    answer of `answer_tokens` tokens. Every response waits `first_token_latency`
+    seconds, then emits `tokens_per_second` chunks per second.
+    """
+
+    def __init__(
+        self,
+        tokens_per_second: float = 50.0,
+        first_token_latency: float = 0.3,
+        answer_tokens: int = 150,
+        function_call_rate: float = 0.8,
+        seed: int = 0,
+    ):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.answer_tokens = answer_tokens
+        self.function_call_rate = function_call_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def install(self):
+        """Patches litellm so the agents stream from this stub."""
+        import litellm
+
+        litellm.completion = self.completion
+        litellm.acompletion = self.acompletion
+
+    def chunks(self, kwargs):
+        messages = kwargs["messages"]
+        last_user = max(i for i, m in enumerate(messages) if m["role"] == "user")
+        has_results = any(m["role"] in ("function", "tool") for m in messages[last_user:])
+        with self.lock:
+            self.calls += 1
+            call_tool = self.random.random() < self.function_call_rate
+            tool = self.random.choice(TOOL_NAMES)
+        offers_tools = "tools" in kwargs or "functions" in kwargs
+        if offers_tools and call_tool and not has_results:
+            arguments = json.dumps({"query": messages[last_user]["content"]})
+            parts = [arguments[i : i + 8] for i in range(0, len(arguments), 8)]
+            if "tools" in kwargs:
+                yield chunk(tool_calls=[Obj(index=0, id="call_0", function=Obj(name=tool, arguments=""))])
+                for part in parts:
+                    yield chunk(tool_calls=[Obj(index=0, id=None, function=Obj(name=None, arguments=part))])
+            else:
+                yield chunk(function_call=Obj(name=tool, arguments=""))
+                for part in parts:
+                    yield chunk(function_call=Obj(name=None, arguments=part))
+        else:
+            for i in range(self.answer_tokens):
+                yield chunk(content=f"tok{i} ")
+        yield chunk()
+
+    def completion(self, **kwargs):
+        def stream():
+            time.sleep(self.first_token_latency)
+            for c in self.chunks(kwargs):
+                yield c
+                time.sleep(1 / self.tokens_per_second)
+
+        return stream()
+
+    async def acompletion(self, **kwargs):
+        async def stream():
+            await asyncio.sleep(self.first_token_latency)
+            for c in self.chunks(kwargs):
+                yield c
+                await asyncio.sleep(1 / self.tokens_per_second)
+
+        return stream()
+
+
+class StubSearchServer(ThreadingHTTPServer):
+    """Serves fake Kalimat and Vectara search responses on localhost.
+
+    Each request sleeps `latency` seconds (plus up to `jitter`), or
+    `tail_latency` seconds with probability `tail_rate`, and fails with HTTP 503
+    with probability `error_rate`.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        latency: float = 0.15,
+        jitter: float = 0.1,
+        error_rate: float = 0.0,
+        tail_rate: float = 0.0,
+        tail_latency: float = 2.0,
+        seed: int = 0,
+    ):
+        super().__init__(("127.0.0.1", 0), StubSearchHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True, name="stub-search").start()
+        return self
+
+    def delay_and_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.random.random() * self.jitter
+            if self.random.random() < self.tail_rate:
+                delay = self.tail_latency
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+        time.sleep(delay)
+        return failed
+
+    def point_tools(self, agent):
+        """Points the search tools of an agent (or of a VariantRegistry) at this server."""
+        for name, tool in agent.tools.items():
+            tool.base_url = f"{self.url}/v1/query" if name == "search_mawsuah" else f"{self.url}/search"
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_failure(self):
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        if self.server.delay_and_fail():
+            return self.send_failure()
+        query = params.get("query", [""])[0]
+        n = int(params.get("numResults", ["5"])[0])
+        if "indexes" in params:
+            results = [
+                {
+                    "id": f"{i}",
+                    "en_text": f"Hadith about {query} ({i}). " * 8,
+                    "grade_en": "Sahih",
+                    "source_book": "Bukhari",
+                    "chapter_number": 1,
+                    "hadith_number": i,
+                }
+                for i in range(n)
+            ]
+        else:
+            results = [
+                {"id": f"2:{i}", "text": f"آية {i} " * 12, "en_text": f"Verse about {query} ({i}). " * 6}
+                for i in range(n)
+            ]
+        self.send_json(results)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.server.delay_and_fail():
+            return self.send_failure()
+        request = body["query"][0]
+        n = request.get("numResults", 5)
+        self.send_json(
+            {
+                "responseSet": [
+                    {
+                        "response": [
+                            {"text": f"فقرة {i} عن {request['query']} " * 10, "documentIndex": 0, "resultOffset": i * 100}
+                            for i in range(n)
+                        ],
+                        "document": [{"id": "mawsuah-doc-1"}],
+                    }
+                ]
+            }
+        )
+
+    def log_message(self, *args):
+        pass
@@ -1,6 +1,6 @@
 import logging
 from functools import lru_cache
-from typing import Union, Optional
+from typing import Dict, Union, Optional
 from pydantic_settings import BaseSettings
 from pydantic import SecretStr, PostgresDsn, DirectoryPath, Field, validator
 
@@ -20,8 +20,70 @@ class Settings(BaseSettings):
 
     MODEL: str = Field(default="gpt-4o-2024-05-13")
     MAX_FUNCTION_TRIES: int = Field(default=3)
-    MAX_FAILURES: int = Field(default=1)
+    MAX_FAILURES: int = Field(default=1)  # attempts per round when a stream or tool call fails midway
+    # Retries of transient errors: exponential backoff with full jitter between these bounds (seconds)
+    RETRY_MAX_ATTEMPTS: int = Field(default=3)  # per LLM request
+    TOOL_RETRY_MAX_ATTEMPTS: int = Field(default=3)  # per search request
+    RETRY_INITIAL_BACKOFF: float = Field(default=0.5)
+    RETRY_MAX_BACKOFF: float = Field(default=8.0)
+    # Wall-time budget for answering one user message, retries included (seconds; 0 for none)
+    TURN_DEADLINE: float = Field(default=120.0)
+    # Prompt token budget per model (longest matching name prefix wins)
+    CONTEXT_TOKEN_BUDGETS: Dict[str, int] = Field(
+        default={"gpt-4o": 32000, "gpt-4-turbo": 32000, "gpt-4": 7000, "gpt-3.5-turbo": 14000}
+    )
+    CONTEXT_TOKEN_BUDGET: int = Field(default=16000)  # for models not listed above
+    MAX_TOOL_RESULT_TOKENS: int = Field(default=2000)
     SYSTEM_PROMPT_FILE_NAME: str = Field(default="system_msg_fn")
+    # Pick up edits to prompt files, checking each file's mtime at most every PROMPT_RELOAD_INTERVAL seconds
+    PROMPT_HOT_RELOAD: bool = Field(default=True)
+    PROMPT_RELOAD_INTERVAL: float = Field(default=1.0)
+    # Use the tools= API so one assistant turn can request several searches at once
+    PARALLEL_TOOL_CALLS: bool = Field(default=False)
+    # Start a tool call as soon as its "query" argument has streamed in
+    SPECULATIVE_TOOL_CALLS: bool = Field(default=True)
+    # Send each tool call's results as one compact message, skipping passages already sent
+    PACK_TOOL_RESULTS: bool = Field(default=False)
+    # Replay stored answers to identical temperature-0 rounds, per variant, bounded by size and age
+    RESPONSE_CACHE_ENABLED: bool = Field(default=False)
+    RESPONSE_CACHE_MAX_BYTES: int = Field(default=64 * 1024 * 1024)
+    RESPONSE_CACHE_TTL: float = Field(default=24 * 3600)  # seconds
+    # Replays a stored answer at this multiple of the pace it was streamed at (0: all at once)
+    RESPONSE_CACHE_REPLAY_SPEED: float = Field(default=1.0)
+
+    # Advance the A and B streams in separate workers instead of in lockstep
+    CONCURRENT_STREAMS: bool = Field(default=True)
+    # UI updates are batched: at most one per interval (seconds) unless this many characters are pending
+    STREAM_COALESCE_INTERVAL: float = Field(default=0.05)
+    STREAM_COALESCE_CHARS: int = Field(default=200)
+    # Serve conversations with AsyncAnsari on the event loop instead of a thread per stream
+    ASYNC_ENGINE: bool = Field(default=False)
+
+    # Keep-alive HTTP pool shared by the search tools
+    HTTP_POOL_CONNECTIONS: int = Field(default=4)
+    HTTP_POOL_MAXSIZE: int = Field(default=20)  # per host
+    HTTP_CONNECT_TIMEOUT: float = Field(default=5.0)
+    HTTP_READ_TIMEOUT: float = Field(default=30.0)
+
+    # Tool result cache (in-memory LRU with TTL, optionally backed by SQLite)
+    TOOL_CACHE_ENABLED: bool = Field(default=True)
+    TOOL_CACHE_MAX_ENTRIES: int = Field(default=2048)
+    TOOL_CACHE_TTL: float = Field(default=6 * 3600)  # seconds
+    TOOL_CACHE_SQLITE_PATH: Optional[str] = Field(default=None)
+
+    # Hedged search requests: resend a request still pending after the HEDGE_PERCENTILE
+    # latency of its tool; hedges are limited to HEDGE_BUDGET_RATIO of requests per tool
+    TOOL_HEDGING: bool = Field(default=False)
+    HEDGE_PERCENTILE: float = Field(default=0.95)
+    HEDGE_BUDGET_RATIO: float = Field(default=0.1)
+    HEDGE_MIN_DELAY: float = Field(default=0.05)  # seconds
+    HEDGE_MIN_SAMPLES: int = Field(default=20)
+
+    # Admission control per upstream backend, keyed by LLM model name or tool host (e.g.
+    # "gpt-4o", "api.kalimat.dev"): {"concurrency": calls in flight, "rate": cost per second,
+    # "burst": cost}, where a call costs its prompt tokens (LLM) or 1 (tools). Waiting calls
+    # are served round-robin across browser sessions; backends not listed are not limited
+    ADMISSION_LIMITS: Dict[str, Dict[str, float]] = Field(default={})
 
     # A/B Testing database connection configuration
     AB_TESTING_DB_NAME: str
@@ -30,10 +92,46 @@ class Settings(BaseSettings):
     AB_TESTING_DB_HOST: str
     AB_TESTING_DB_PORT: int
     
+    # Background vote writer
+    VOTE_QUEUE_SIZE: int = Field(default=10000)
+    VOTE_BATCH_SIZE: int = Field(default=100)
+    VOTE_FLUSH_INTERVAL: float = Field(default=1.0)  # seconds
+    # Store prompts and messages once by hash (needs resources/sql/001_content_addressed_conversations.sql)
+    CONTENT_ADDRESSED_CONVERSATIONS: bool = Field(default=False)
+    # Keep running vote counts per experiment for the Results tab (needs resources/sql/003_vote_aggregates.sql)
+    VOTE_AGGREGATES: bool = Field(default=False)
+    VOTE_BOOTSTRAP_SAMPLES: int = Field(default=1000)
+    # Store per-turn latency and token metrics with each vote (needs resources/sql/002_comparison_metrics.sql)
+    STORE_TURN_METRICS: bool = Field(default=False)
+
+    # Background Langfuse export (when LANGFUSE_SECRET_KEY is set); past half a full queue
+    # only TRACE_PRESSURE_SAMPLE_RATE of generations are kept
+    TRACE_QUEUE_SIZE: int = Field(default=1000)
+    TRACE_BATCH_SIZE: int = Field(default=50)
+    TRACE_FLUSH_INTERVAL: float = Field(default=2.0)  # seconds
+    TRACE_PRESSURE_SAMPLE_RATE: float = Field(default=0.1)
+
+    # Once the port is open, build the variants and import litellm in the background
+    WARM_UP_ON_START: bool = Field(default=True)
+
+    # Port for the Prometheus-style /metrics endpoint; not served if unset
+    METRICS_PORT: Optional[int] = Field(default=None)
+
     # A/B Testing environment variables
     AB_TESTING_EXPERIMENT_ID: int
     AB_TESTING_MODEL_1_ID: int
     AB_TESTING_MODEL_2_ID: int
+    # Variants compared, as model id -> {"prompt": file name, "model": LLM, "name": label}, each key
+    # optional; defaults to system_msg_fn_v1 as MODEL_1 and system_msg_fn as MODEL_2
+    AB_TESTING_VARIANTS: Dict[int, Dict[str, str]] = Field(default={})
+    # Weight every pair gets on top of its ranking uncertainty when picking what to compare
+    PAIR_EXPLORE: float = Field(default=0.02)
+
+    # Limits of the server-side conversation store: conversations, compressed bytes,
+    # and seconds of inactivity after which a conversation is dropped
+    SESSION_STORE_MAX_SESSIONS: int = Field(default=10000)
+    SESSION_STORE_MAX_BYTES: int = Field(default=256 * 1024 * 1024)
+    SESSION_IDLE_TTL: float = Field(default=3600)
 
 @lru_cache()
 def get_settings() -> Settings:
@@ -0,0 +1,15 @@
+-- Content-addressed storage for system prompts and chat messages.
+-- Conversations written with CONTENT_ADDRESSED_CONVERSATIONS=true store
+-- {"v": 1, "prompt": <hash>, "turns": [[<user hash>, <assistant hash>], ...]}
+-- in ab_testing.ab_testing_conversations.conversation instead of the full text.
+
+CREATE TABLE IF NOT EXISTS ab_testing.prompt_versions (
+    prompt_hash CHAR(64) PRIMARY KEY,
+    content TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS ab_testing.message_blocks (
+    block_hash CHAR(64) PRIMARY KEY,
+    content TEXT NOT NULL
+);
@@ -0,0 +1,5 @@
+-- Per-turn latency and token metrics stored with each vote.
+-- Votes written with STORE_TURN_METRICS=true fill this column with
+-- {"A": [<turn metrics>, ...], "B": [...]}, one entry per turn of each side.
+
+ALTER TABLE ab_testing.ab_testing_comparisons ADD COLUMN IF NOT EXISTS metrics JSONB;
@@ -0,0 +1,18 @@
+-- Running vote counts per experiment and model pair.
+-- Votes written with VOTE_AGGREGATES=true also increment the row of their
+-- (experiment, pair) in the same transaction, so results are read from one row
+-- instead of scanning ab_testing.ab_testing_comparisons. model_1_id is always
+-- the lower id of the pair. To count votes cast before this table existed, run
+-- `python -m util.vote_analytics --rebuild` once.
+
+CREATE TABLE IF NOT EXISTS ab_testing.vote_aggregates (
+    experiment_id INTEGER NOT NULL,
+    model_1_id INTEGER NOT NULL,
+    model_2_id INTEGER NOT NULL,
+    model_1_wins BIGINT NOT NULL DEFAULT 0,
+    model_2_wins BIGINT NOT NULL DEFAULT 0,
+    ties BIGINT NOT NULL DEFAULT 0,
+    both_bad BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (experiment_id, model_1_id, model_2_id)
+);
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import util.admission
+from util.admission import AdmissionLimiter, Waiter
+from util.retry import Deadline, DeadlineExceeded
+
+
+def queued(limiter):
+    with limiter.lock:
+        return sum(len(queue) for queue in limiter.queues.values())
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.001)
+
+
+def test_clients_are_served_round_robin():
+    limiter = AdmissionLimiter("test", concurrency=1)
+    limiter.acquire("blocker")
+    order = []
+
+    def call(client, name):
+        limiter.acquire(client)
+        order.append(name)
+        limiter.release()
+
+    threads = []
+    for client, name in [("a", "a0"), ("a", "a1"), ("a", "a2"), ("b", "b0")]:
+        thread = threading.Thread(target=call, args=(client, name))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: queued(limiter) == len(threads))
+    limiter.release()
+    for thread in threads:
+        thread.join(2.0)
+
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert limiter.in_flight == 0
+
+
+def test_deadline_gives_up_while_queued():
+    limiter = AdmissionLimiter("test", concurrency=1)
+    limiter.acquire()
+
+    with pytest.raises(DeadlineExceeded):
+        limiter.acquire("a", deadline=Deadline(0.05))
+
+    assert queued(limiter) == 0
+    assert limiter.in_flight == 1
+
+
+def test_admitted_while_giving_up_keeps_the_slot(monkeypatch):
+    limiter = AdmissionLimiter("test", concurrency=1)
+    limiter.acquire()
+
+    class LateWaiter(Waiter):
+        """Times out just as the slot it waits for is released to it."""
+
+        def __init__(self, client, cost, loop=None):
+            super().__init__(client, cost, loop)
+            event = self.event
+
+            class Event:
+                def wait(self, timeout=None):
+                    limiter.release()
+                    return False
+
+                def set(self):
+                    event.set()
+
+            self.event = Event()
+
+    monkeypatch.setattr(util.admission, "Waiter", LateWaiter)
+    limiter.acquire("a", deadline=Deadline(0.05))
+
+    assert queued(limiter) == 0
+    assert limiter.in_flight == 1
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_cancelled_aacquire_leaves_the_queue():
+    limiter = AdmissionLimiter("test", concurrency=1)
+    limiter.acquire()
+
+    async def main():
+        task = asyncio.ensure_future(limiter.aacquire("a"))
+        await asyncio.sleep(0.01)
+        assert queued(limiter) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert queued(limiter) == 0
+    assert limiter.in_flight == 1
+
+
+def test_cancelled_aacquire_releases_a_granted_slot():
+    limiter = AdmissionLimiter("test", concurrency=1)
+    limiter.acquire()
+
+    async def main():
+        task = asyncio.ensure_future(limiter.aacquire("a"))
+        await asyncio.sleep(0.01)
+        # Admitted, but cancelled before it could resume
+        limiter.release()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert queued(limiter) == 0
+    assert limiter.in_flight == 0
+
+
+def test_bucket_refill_wakes_the_queue():
+    limiter = AdmissionLimiter("test", rate=20.0, burst=1)
+    limiter.acquire()
+    start = time.monotonic()
+
+    # Nothing is released: only the refill timer can admit this call
+    limiter.acquire(deadline=Deadline(2.0))
+
+    assert time.monotonic() - start >= 0.03
+    assert limiter.in_flight == 2
+    assert limiter.timer is None
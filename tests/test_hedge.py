@@ -0,0 +1,69 @@
+import asyncio
+import threading
+import time
+
+from util.admission import AdmissionLimiter
+from util.hedge import Hedger, hedges_won
+
+
+def make_hedger():
+    hedger = Hedger("test", min_delay=0.01, min_samples=1)
+    hedger.latencies.add(0.01)
+    return hedger
+
+
+def test_hedge_wins_after_primary_failure():
+    hedger = make_hedger()
+    calls = []
+    lock = threading.Lock()
+
+    def fn():
+        with lock:
+            calls.append(len(calls))
+            attempt = calls[-1]
+        if attempt == 0:
+            time.sleep(0.05)
+            raise ConnectionError("primary failed")
+        time.sleep(0.1)
+        return "hedge"
+
+    won = hedges_won.series.get(("test",), 0)
+    assert hedger.call(fn) == "hedge"
+    assert len(calls) == 2
+    assert hedges_won.series[("test",)] == won + 1
+
+
+def test_async_hedge_wins_after_primary_failure():
+    hedger = make_hedger()
+    calls = []
+
+    async def fn():
+        calls.append(len(calls))
+        if calls[-1] == 0:
+            await asyncio.sleep(0.05)
+            raise ConnectionError("primary failed")
+        await asyncio.sleep(0.1)
+        return "hedge"
+
+    assert asyncio.run(hedger.acall(fn)) == "hedge"
+    assert len(calls) == 2
+
+
+def test_denied_hedge_keeps_rate_tokens():
+    hedger = make_hedger()
+    hedger.budget.tokens = 0
+    limiter = AdmissionLimiter("test", rate=1.0, burst=2)
+
+    assert not hedger.may_hedge(limiter, "a")
+    assert limiter.bucket.tokens == 2
+    assert limiter.in_flight == 0
+
+
+def test_hedge_without_a_slot_refunds_the_budget():
+    hedger = make_hedger()
+    hedger.budget.tokens = 1
+    limiter = AdmissionLimiter("test", concurrency=1)
+    limiter.acquire()
+
+    assert not hedger.may_hedge(limiter, "a")
+    assert hedger.budget.tokens == 1
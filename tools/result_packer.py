@@ -0,0 +1,22 @@
+def pack_results(passages, seen=()) -> str:
+    """Merges one tool call's passages into a single compact message.
+
+    Args:
+        passages: [passage id, text] pairs as returned by a tool's `run_as_passages`.
+        seen: Ids of passages the model can already see in the prompt. Passages
+            found in it are replaced by a reference.
+
+    """
+    if not passages:
+        return "No results found"
+    new, repeated, shown = [], [], set()
+    for passage_id, text in passages:
+        if passage_id in seen or passage_id in shown:
+            repeated.append(passage_id)
+        else:
+            shown.add(passage_id)
+            new.append(text)
+    parts = new
+    if repeated:
+        parts = parts + [f"(Already shown above: {', '.join(repeated)})"]
+    return "\n\n".join(parts)
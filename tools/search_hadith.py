@@ -1,16 +1,21 @@
+import logging
 import os
 
-import requests
+from util.http_client import HttpClient, HttpStatusError
+
+logger = logging.getLogger(__name__)
 
 KALEMAT_BASE_URL = "https://api.kalimat.dev/search"
 FN_NAME = "search_hadith"
+NUM_RESULTS = 3
 
 
 class SearchHadith:
 
-    def __init__(self, kalimat_api_key):
+    def __init__(self, kalimat_api_key, http_client=None):
         self.api_key = kalimat_api_key
         self.base_url = KALEMAT_BASE_URL
+        self.http = http_client or HttpClient()
 
     def get_function_description(self):
         return {
@@ -31,8 +36,10 @@ class SearchHadith:
     def get_fn_name(self):
         return FN_NAME
 
-    def run(self, query: str, numResults: int = 5):
+    def get_num_results(self):
+        return NUM_RESULTS
 
+    def _request_args(self, query: str, numResults: int):
         headers = {"x-api-key": self.api_key}
         payload = {
             "query": query,
@@ -40,16 +47,25 @@ class SearchHadith:
             "indexes": '["sunnah_lk"]',
             "getText": 2,
         }
+        return headers, payload
 
-        response = requests.get(self.base_url, headers=headers, params=payload)
-
+    def _check_response(self, response):
         if response.status_code != 200:
-            raise Exception(
-                f"Request failed with status {response.status_code} {response.text}"
+            raise HttpStatusError(
+                f"Request failed with status {response.status_code} {response.text}", response.status_code
             )
-
         return response.json()
 
+    def run(self, query: str, numResults: int = 5):
+        headers, payload = self._request_args(query, numResults)
+        response = self.http.get(self.base_url, headers=headers, params=payload)
+        return self._check_response(response)
+
+    async def arun(self, query: str, numResults: int = 5):
+        headers, payload = self._request_args(query, numResults)
+        response = await self.http.aget(self.base_url, headers=headers, params=payload)
+        return self._check_response(response)
+
     def pp_hadith(self, h):
         en = h["en_text"]
         grade = h["grade_en"].strip()
@@ -60,11 +76,31 @@ class SearchHadith:
         # print(f'Hadith is: {result}')
         return result
 
-    def run_as_list(self, query: str, num_results: int = 3):
-        print(f'Searching hadith for "{query}"')
+    def run_as_list(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching hadith for "{query}"')
         results = self.run(query, num_results)
         return [self.pp_hadith(r) for r in results]
 
+    async def arun_as_list(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching hadith for "{query}"')
+        results = await self.arun(query, num_results)
+        return [self.pp_hadith(r) for r in results]
+
+    def pp_passage(self, h):
+        """Returns [passage id, compact text] for result packing."""
+        grade = h["grade_en"].strip()
+        grade = f", Grade: {grade}" if grade else ""
+        src = f"[{h['source_book']} {h['chapter_number']}:{h['hadith_number']}, LK id: {h['id']}{grade}]"
+        return [f"hadith:{h['id']}", f"{src}\n{h['en_text']}"]
+
+    def run_as_passages(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching hadith for "{query}"')
+        return [self.pp_passage(r) for r in self.run(query, num_results)]
+
+    async def arun_as_passages(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching hadith for "{query}"')
+        return [self.pp_passage(r) for r in await self.arun(query, num_results)]
+
     def run_as_string(self, query: str, num_results: int = 3):
         results = self.run(query, num_results)
         rstring = "\n".join([self.pp_ayah(r) for r in results])
@@ -1,16 +1,23 @@
+import hashlib
 import json
-import requests
+import logging
+
+from util.http_client import HttpClient
+
+logger = logging.getLogger(__name__)
 
 VECTARA_BASE_URL = "https://api.vectara.io:443/v1/query"
 FN_NAME = "search_mawsuah"
+NUM_RESULTS = 10
 
 class SearchMawsuah:
 
-    def __init__(self, vectara_auth_token, vectara_customer_id, vectara_corpus_id):
+    def __init__(self, vectara_auth_token, vectara_customer_id, vectara_corpus_id, http_client=None):
         self.auth_token = vectara_auth_token
         self.customer_id = vectara_customer_id
         self.corpus_id = vectara_corpus_id
         self.base_url = VECTARA_BASE_URL
+        self.http = http_client or HttpClient()
 
     def get_function_description(self):
         return {
@@ -31,8 +38,10 @@ class SearchMawsuah:
     def get_fn_name(self):
         return FN_NAME
 
-    def run(self, query: str, num_results: int = 5):
-        print(f'Searching al-mawsuah for "{query}"')
+    def get_num_results(self):
+        return NUM_RESULTS
+
+    def _request_args(self, query: str, num_results: int):
         # Headers
         headers = {
             "x-api-key": self.auth_token,
@@ -70,16 +79,30 @@ class SearchMawsuah:
             ]
         }
 
-        response = requests.post(self.base_url, headers=headers, data=json.dumps(data))
+        return headers, json.dumps(data)
 
+    def _check_response(self, response):
         if response.status_code != 200:
-            print(
-                f"Query failed with code {response.status_code}, reason {response.reason}, text {response.text}"
+            reason = getattr(response, "reason", None) or getattr(response, "reason_phrase", "")
+            logger.warning(
+                f"Query failed with code {response.status_code}, reason {reason}, text {response.text}"
             )
             response.raise_for_status()
 
         return response.json()
 
+    def run(self, query: str, num_results: int = 5):
+        logger.info(f'Searching al-mawsuah for "{query}"')
+        headers, data = self._request_args(query, num_results)
+        response = self.http.post(self.base_url, headers=headers, data=data)
+        return self._check_response(response)
+
+    async def arun(self, query: str, num_results: int = 5):
+        logger.info(f'Searching al-mawsuah for "{query}"')
+        headers, data = self._request_args(query, num_results)
+        response = await self.http.apost(self.base_url, headers=headers, content=data)
+        return self._check_response(response)
+
     def pp_response(self, response):
         results = []
         for response_item in response["responseSet"]:
@@ -87,8 +110,33 @@ class SearchMawsuah:
                 results.append(result["text"])
         return results
 
-    def run_as_list(self, query: str, num_results: int = 10):
+    def pp_passages(self, response):
+        """Returns [passage id, text] pairs for result packing. A passage is
+        identified by its document and offset, or by its text if those are missing."""
+        passages = []
+        for response_item in response["responseSet"]:
+            documents = response_item.get("document", [])
+            for result in response_item["response"]:
+                index = result.get("documentIndex")
+                if index is not None and index < len(documents) and "resultOffset" in result:
+                    passage_id = f"{documents[index]['id']}:{result['resultOffset']}"
+                else:
+                    passage_id = hashlib.sha1(result["text"].encode()).hexdigest()[:16]
+                passage_id = f"mawsuah:{passage_id}"
+                passages.append([passage_id, f"[{passage_id}] {result['text']}"])
+        return passages
+
+    def run_as_list(self, query: str, num_results: int = NUM_RESULTS):
         return self.pp_response(self.run(query, num_results))
 
+    async def arun_as_list(self, query: str, num_results: int = NUM_RESULTS):
+        return self.pp_response(await self.arun(query, num_results))
+
+    def run_as_passages(self, query: str, num_results: int = NUM_RESULTS):
+        return self.pp_passages(self.run(query, num_results))
+
+    async def arun_as_passages(self, query: str, num_results: int = NUM_RESULTS):
+        return self.pp_passages(await self.arun(query, num_results))
+
     def run_as_json(self, query: str, num_results: int = 10):
         return {"matches": self.pp_response(self.run(query, num_results))}
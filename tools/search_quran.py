@@ -1,14 +1,20 @@
-import requests
+import logging
+
+from util.http_client import HttpClient, HttpStatusError
+
+logger = logging.getLogger(__name__)
 
 KALEMAT_BASE_URL = "https://api.kalimat.dev/search"
 FN_NAME = "search_quran"
+NUM_RESULTS = 10
 
 
 class SearchQuran:
 
-    def __init__(self, kalimat_api_key):
+    def __init__(self, kalimat_api_key, http_client=None):
         self.api_key = kalimat_api_key
         self.base_url = KALEMAT_BASE_URL
+        self.http = http_client or HttpClient()
 
     def get_function_description(self):
         return {
@@ -29,22 +35,33 @@ class SearchQuran:
     def get_fn_name(self):
         return FN_NAME
 
-    def run(self, query: str, num_results: int = 5):
+    def get_num_results(self):
+        return NUM_RESULTS
 
+    def _request_args(self, query: str, num_results: int):
         headers = {"x-api-key": self.api_key}
         payload = {
             "query": query,
             "numResults": num_results,
             "getText": 1,  # 1 is the Qur'an
         }
+        return headers, payload
 
-        response = requests.get(self.base_url, headers=headers, params=payload)
-
+    def _check_response(self, response):
         if response.status_code != 200:
-            raise Exception(f"Request failed with status {response.status_code}")
-
+            raise HttpStatusError(f"Request failed with status {response.status_code}", response.status_code)
         return response.json()
 
+    def run(self, query: str, num_results: int = 5):
+        headers, payload = self._request_args(query, num_results)
+        response = self.http.get(self.base_url, headers=headers, params=payload)
+        return self._check_response(response)
+
+    async def arun(self, query: str, num_results: int = 5):
+        headers, payload = self._request_args(query, num_results)
+        response = await self.http.aget(self.base_url, headers=headers, params=payload)
+        return self._check_response(response)
+
     def pp_ayah(self, ayah):
         ayah_num = ayah["id"]
         ayah_ar = "Not retrieved"
@@ -58,11 +75,28 @@ class SearchQuran:
         )
         return result
 
-    def run_as_list(self, query: str, num_results: int = 10):
-        print(f'Searching quran for "{query}"')
+    def run_as_list(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching quran for "{query}"')
         results = self.run(query, num_results)
         return [self.pp_ayah(r) for r in results]
 
+    async def arun_as_list(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching quran for "{query}"')
+        results = await self.arun(query, num_results)
+        return [self.pp_ayah(r) for r in results]
+
+    def pp_passage(self, ayah):
+        """Returns [passage id, compact text] for result packing."""
+        return [f"quran:{ayah['id']}", f"[Ayah {ayah['id']}] {ayah.get('text', '')}\n{ayah.get('en_text', '')}"]
+
+    def run_as_passages(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching quran for "{query}"')
+        return [self.pp_passage(r) for r in self.run(query, num_results)]
+
+    async def arun_as_passages(self, query: str, num_results: int = NUM_RESULTS):
+        logger.info(f'Searching quran for "{query}"')
+        return [self.pp_passage(r) for r in await self.arun(query, num_results)]
+
     def run_as_string(self, query: str, num_results: int = 10, getText: int = 1):
         results = self.run(query, num_results, getText)
         rstring = "\n".join([self.pp_ayah(r) for r in results])
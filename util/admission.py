@@ -0,0 +1,320 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from util.metrics import registry
+from util.retry import DeadlineExceeded
+
+admission_queue_depth = registry.gauge(
+    "ansari_admission_queue_depth", "Upstream calls waiting for admission, by backend.", ["backend"]
+)
+admission_in_flight = registry.gauge(
+    "ansari_admission_in_flight", "Admitted upstream calls still running.", ["backend"]
+)
+admission_wait_seconds = registry.histogram(
+    "ansari_admission_wait_seconds", "Time upstream calls waited for admission, by backend.", ["backend"]
+)
+admission_timeouts = registry.counter(
+    "ansari_admission_timeouts_total", "Calls whose turn deadline passed while waiting for admission.", ["backend"]
+)
+
+
+class TokenBucket:
+    """`rate` units of cost per second, of which up to `burst` can be saved up.
+    Not thread-safe; AdmissionLimiter uses it under its lock."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float) -> float:
+        """Takes `cost` units and returns 0, or returns the seconds until they are
+        available. Costs above `burst` are capped to it, so a large call still runs."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Waiter:
+    """One call waiting for admission; woken through an Event, or a future on its event loop."""
+
+    __slots__ = ("client", "cost", "granted", "event", "future", "loop")
+
+    def __init__(self, client, cost, loop=None):
+        self.client = client
+        self.cost = cost
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self.future is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+class AdmissionLimiter:
+    """Admission of calls to one upstream backend.
+
+    At most `concurrency` calls run at once and calls start at no more than
+    `rate` units of cost per second, saving up to `burst` (0 means no limit).
+    A call that cannot start waits in its client's queue, and clients (browser
+    sessions) are served round-robin, so one client with many calls queued
+    delays each other client by at most one call per round. A waiting call
+    gives up with DeadlineExceeded when its turn's deadline passes.
+    """
+
+    def __init__(self, backend: str, concurrency: int = 0, rate: float = 0.0, burst: float = None):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst or rate) if rate else None
+        self.queues = OrderedDict()  # client -> deque of waiters, in round-robin order
+        self.in_flight = 0
+        self.timer = None  # re-runs the dispatch once the bucket has refilled
+        self.lock = threading.Lock()
+
+    def _enqueue(self, waiter):
+        queue = self.queues.get(waiter.client)
+        if queue is None:
+            queue = self.queues[waiter.client] = deque()
+        queue.append(waiter)
+        admission_queue_depth.inc(backend=self.backend)
+
+    def _remove(self, waiter):
+        queue = self.queues[waiter.client]
+        queue.remove(waiter)
+        if not queue:
+            del self.queues[waiter.client]
+        admission_queue_depth.dec(backend=self.backend)
+
+    def _dispatch(self):
+        """Admits queued calls while there is room. Called with the lock held."""
+        while self.queues:
+            if self.concurrency and self.in_flight >= self.concurrency:
+                return
+            client, queue = next(iter(self.queues.items()))
+            waiter = queue[0]
+            if self.bucket:
+                wait = self.bucket.take(waiter.cost)
+                if wait > 0:
+                    if self.timer is None:
+                        self.timer = threading.Timer(wait, self._refilled)
+                        self.timer.daemon = True
+                        self.timer.start()
+                    return
+            queue.popleft()
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            admission_queue_depth.dec(backend=self.backend)
+            self.in_flight += 1
+            admission_in_flight.inc(backend=self.backend)
+            waiter.granted = True
+            waiter.wake()
+
+    def _refilled(self):
+        with self.lock:
+            self.timer = None
+            self._dispatch()
+
+    def _give_up(self, waiter) -> bool:
+        """Takes a waiter that stopped waiting out of the queue. Returns True if it
+        had been admitted meanwhile, in which case it holds a slot."""
+        with self.lock:
+            if waiter.granted:
+                return True
+            self._remove(waiter)
+            # The head of the queue may have been blocking smaller calls behind it
+            self._dispatch()
+            return False
+
+    def acquire(self, client=None, cost: float = 1, deadline=None):
+        """Waits until the call may start. Raises DeadlineExceeded if `deadline` passes first."""
+        start = time.monotonic()
+        waiter = Waiter(client, cost)
+        with self.lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        if not waiter.granted:
+            timeout = None if deadline is None or deadline.expires_at is None else max(0.0, deadline.remaining())
+            if not waiter.event.wait(timeout) and not self._give_up(waiter):
+                admission_timeouts.inc(backend=self.backend)
+                raise DeadlineExceeded(f"Turn deadline exceeded waiting for admission to {self.backend}")
+        admission_wait_seconds.observe(time.monotonic() - start, backend=self.backend)
+
+    async def aacquire(self, client=None, cost: float = 1, deadline=None):
+        """Awaits admission without blocking the event loop; see `acquire`."""
+        start = time.monotonic()
+        waiter = Waiter(client, cost, asyncio.get_running_loop())
+        with self.lock:
+            self._enqueue(waiter)
+            self._dispatch()
+        if not waiter.granted:
+            timeout = None if deadline is None or deadline.expires_at is None else max(0.0, deadline.remaining())
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                if not self._give_up(waiter):
+                    admission_timeouts.inc(backend=self.backend)
+                    raise DeadlineExceeded(f"Turn deadline exceeded waiting for admission to {self.backend}")
+            except asyncio.CancelledError:
+                if self._give_up(waiter):
+                    self.release()
+                raise
+        admission_wait_seconds.observe(time.monotonic() - start, backend=self.backend)
+
+    def try_acquire(self, client=None, cost: float = 1) -> bool:
+        """Admits the call only if it can start right away, ahead of no one. Returns
+        whether it was admitted; if so it must be released like any other."""
+        with self.lock:
+            if self.queues or (self.concurrency and self.in_flight >= self.concurrency):
+                return False
+            if self.bucket and self.bucket.take(cost) > 0:
+                return False
+            self.in_flight += 1
+            admission_in_flight.inc(backend=self.backend)
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            admission_in_flight.dec(backend=self.backend)
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, client=None, cost: float = 1, deadline=None):
+        self.acquire(client, cost, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aadmit(self, client=None, cost: float = 1, deadline=None):
+        await self.aacquire(client, cost, deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def wrap(self, fn, client=None, deadline=None):
+        """Returns fn admitted as a call of cost 1 each time it is called."""
+
+        def admitted(*args, **kwargs):
+            with self.admit(client, 1, deadline):
+                return fn(*args, **kwargs)
+
+        return admitted
+
+    def awrap(self, fn, client=None, deadline=None):
+        async def admitted(*args, **kwargs):
+            async with self.aadmit(client, 1, deadline):
+                return await fn(*args, **kwargs)
+
+        return admitted
+
+    def admit_stream(self, start, client=None, cost: float = 1, deadline=None):
+        """Admits a streaming call: returns the stream of `start()`, which holds the
+        admission until it ends, fails or is passed to release_stream."""
+        self.acquire(client, cost, deadline)
+        try:
+            return AdmittedStream(start(), self)
+        except BaseException:
+            self.release()
+            raise
+
+    async def aadmit_stream(self, start, client=None, cost: float = 1, deadline=None):
+        await self.aacquire(client, cost, deadline)
+        try:
+            return AsyncAdmittedStream(await start(), self)
+        except BaseException:
+            self.release()
+            raise
+
+
+class AdmittedStream:
+    """A stream holding its limiter's admission until it ends, fails or is released."""
+
+    def __init__(self, stream, limiter):
+        self.stream = iter(stream)
+        self.limiter = limiter
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self.stream)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        limiter, self.limiter = self.limiter, None
+        if limiter is not None:
+            limiter.release()
+
+    def __del__(self):
+        self.release()
+
+
+class AsyncAdmittedStream(AdmittedStream):
+    def __init__(self, stream, limiter):
+        self.stream = stream.__aiter__()
+        self.limiter = limiter
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.stream.__anext__()
+        except BaseException:
+            self.release()
+            raise
+
+
+def release_stream(response):
+    """Frees the admission held by a stream from `admit_stream`, once the caller has
+    read what it needs; any other stream is left alone."""
+    if isinstance(response, AdmittedStream):
+        response.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(settings, backend: str):
+    """Returns the process-wide AdmissionLimiter for a backend (an LLM model name or
+    a tool's host), or None if ADMISSION_LIMITS does not list it."""
+    limits = settings.ADMISSION_LIMITS.get(backend)
+    if not limits:
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(backend)
+        if limiter is None:
+            limiter = _limiters[backend] = AdmissionLimiter(
+                backend,
+                concurrency=int(limits.get("concurrency", 0)),
+                rate=float(limits.get("rate", 0)),
+                burst=limits.get("burst"),
+            )
+        return limiter
@@ -0,0 +1,169 @@
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Tokens OpenAI adds around every chat message
+TOKENS_PER_MESSAGE = 4
+TRUNCATION_MARKER = "\n[... truncated]"
+
+
+def get_encoding(model: str):
+    """Returns the tiktoken encoding for a model, or None if it is unavailable
+    (unknown model without a fallback, or the BPE file cannot be downloaded)."""
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable for {model}, estimating tokens from length: {e}")
+        return None
+
+
+def budget_for_model(model: str, budgets: dict, default: int) -> int:
+    """Returns the budget of the longest model-name prefix in budgets, else default."""
+    matches = [name for name in budgets if model.startswith(name)]
+    return budgets[max(matches, key=len)] if matches else default
+
+
+class ContextWindow:
+    """Keeps the messages sent to the model within a token budget.
+
+    Token counts are cached per message content, so each message is encoded
+    once no matter how many rounds resend it. `fit` first truncates tool results
+    longer than `max_tool_tokens`, then, while the total is over `budget`, drops
+    the tool results of earlier turns and finally the earliest turns themselves.
+    The system prompt and the current turn are always kept. Tool results that
+    carry their "passages" are packed again over the messages left, so a
+    reference to an earlier passage is only sent while that passage is.
+    """
+
+    def __init__(self, model: str, budget: int, max_tool_tokens: int, max_cached: int = 50000):
+        self.budget = budget
+        self.max_tool_tokens = max_tool_tokens
+        self.max_cached = max_cached
+        self.model = model
+        self.encoding_loaded = False
+        self._encoding = None
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+        self.encoding_lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        # Loaded on first use, or by the startup warm-up; tiktoken may need to
+        # download the BPE file, so concurrent first callers wait for one load
+        if not self.encoding_loaded:
+            with self.encoding_lock:
+                if not self.encoding_loaded:
+                    self._encoding = get_encoding(self.model)
+                    self.encoding_loaded = True
+        return self._encoding
+
+    def count(self, text) -> int:
+        if not text:
+            return 0
+        with self.lock:
+            n = self.counts.get(text)
+            if n is not None:
+                self.counts.move_to_end(text)
+                return n
+        n = len(self.encoding.encode(text)) if self.encoding else len(text) // 4 + 1
+        with self.lock:
+            self.counts[text] = n
+            while len(self.counts) > self.max_cached:
+                self.counts.popitem(last=False)
+        return n
+
+    def message_tokens(self, message) -> int:
+        n = TOKENS_PER_MESSAGE + self.count(message.get("content"))
+        for call in message.get("tool_calls") or ():
+            n += self.count(call["function"]["name"]) + self.count(call["function"]["arguments"])
+        return n
+
+    def truncate(self, text: str) -> str:
+        if self.encoding:
+            return self.encoding.decode(self.encoding.encode(text)[: self.max_tool_tokens]) + TRUNCATION_MARKER
+        return text[: self.max_tool_tokens * 4] + TRUNCATION_MARKER
+
+    def fit(self, messages, pack=None):
+        """Returns (messages to send, stats). The input list is not modified.
+
+        Args:
+            messages: The conversation. Packed tool results keep their [id, text]
+                pairs under "passages", with every passage in full as content.
+            pack: Renders such passages given the ids already in the prompt
+                (tools.result_packer.pack_results). Without it the full content is sent.
+
+        """
+        stats = {"input_tokens": 0, "prompt_tokens": 0, "truncated": 0, "dropped": 0}
+        fitted = []
+        for m in messages:
+            stats["input_tokens"] += self.message_tokens(m)
+            if m["role"] in ("function", "tool") and self.count(m.get("content")) > self.max_tool_tokens:
+                m = dict(m, content=self.truncate(m["content"]))
+                # Packed results are counted once they are packed below
+                if not (pack and "passages" in m):
+                    stats["truncated"] += 1
+            fitted.append(m)
+        sizes = [self.message_tokens(m) for m in fitted]
+        total = sum(sizes)
+
+        if total > self.budget:
+            # Turns start at user messages; the last one is the current turn.
+            starts = [i for i, m in enumerate(fitted) if m["role"] == "user"]
+            current = starts[-1] if starts else len(fitted)
+            keep = [True] * len(fitted)
+            # First drop tool traffic from earlier turns, oldest first. An
+            # assistant tool_calls message goes together with its tool replies.
+            i = 1
+            while i < current and total > self.budget:
+                group = 1 if fitted[i]["role"] == "function" else 0
+                if fitted[i].get("tool_calls"):
+                    group = 1
+                    while i + group < current and fitted[i + group]["role"] == "tool":
+                        group += 1
+                for j in range(i, i + group):
+                    keep[j] = False
+                    total -= sizes[j]
+                i += group or 1
+            # ... then whole earlier turns.
+            for start, end in zip(starts, starts[1:] + [current]):
+                if total <= self.budget or start >= current:
+                    break
+                for i in range(start, end):
+                    if keep[i]:
+                        keep[i] = False
+                        total -= sizes[i]
+            stats["dropped"] = keep.count(False)
+            fitted = [m for m, k in zip(fitted, keep) if k]
+
+        if any("passages" in m for m in fitted):
+            fitted = self.repack(fitted, pack, stats)
+            total = sum(self.message_tokens(m) for m in fitted)
+        stats["prompt_tokens"] = total
+        return fitted, stats
+
+    def repack(self, messages, pack, stats):
+        """Packs the passages of the kept tool results in order, each against the
+        passages sent in full before it, and drops the "passages" key."""
+        seen, repacked = set(), []
+        for m in messages:
+            passages = m.get("passages")
+            if passages is not None:
+                m = {key: value for key, value in m.items() if key != "passages"}
+                if pack is not None:
+                    content = pack(passages, seen)
+                    if self.count(content) > self.max_tool_tokens:
+                        # Passages past the cut may be sent again later
+                        content = self.truncate(content)
+                        stats["truncated"] += 1
+                    else:
+                        seen.update(passage_id for passage_id, _ in passages)
+                    m["content"] = content
+            repacked.append(m)
+        return repacked
@@ -0,0 +1,119 @@
+"""Content-addressed storage for voted conversations.
+
+System prompts are stored once in ab_testing.prompt_versions and chat messages
+once in ab_testing.message_blocks, both keyed by the SHA-256 of their content.
+A conversation row then only holds hashes, so the several-KB prompt and the user
+turns shared by both sides of a comparison are not repeated in every row. See
+resources/sql/001_content_addressed_conversations.sql for the schema.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+
+FORMAT_VERSION = 1
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def is_packed(conversation) -> bool:
+    return isinstance(conversation, dict) and conversation.get("v") == FORMAT_VERSION
+
+
+class ConversationStore:
+    """Packs conversations into hash references and rebuilds them.
+
+    Remembers (up to `max_known` entries) which hashes have already been stored so
+    repeat prompts and messages are not sent to the database again.
+    """
+
+    def __init__(self, max_known: int = 100000):
+        self.max_known = max_known
+        self.known = OrderedDict()
+        self.lock = threading.Lock()
+
+    def pack(self, conversation, prompts: dict, blocks: dict):
+        """Packs a [system_prompt, [user, assistant], ...] conversation.
+
+        Contents not yet known to be stored are added to `prompts` and `blocks`
+        (hash -> text) for the caller to save in the same transaction.
+        """
+        system_prompt, turns = conversation[0], conversation[1:]
+        prompt_ref = self.ref("prompt", system_prompt, prompts)
+        turn_refs = [[self.ref("block", message or "", blocks) for message in turn] for turn in turns]
+        return {"v": FORMAT_VERSION, "prompt": prompt_ref, "turns": turn_refs}
+
+    def ref(self, kind, text, pending):
+        h = content_hash(text)
+        with self.lock:
+            if (kind, h) in self.known:
+                self.known.move_to_end((kind, h))
+                return h
+        pending[h] = text
+        return h
+
+    def mark_stored(self, prompts: dict, blocks: dict):
+        """Records hashes as stored; call only after the transaction committed."""
+        with self.lock:
+            for kind, hashes in (("prompt", prompts), ("block", blocks)):
+                for h in hashes:
+                    self.known[(kind, h)] = True
+                    self.known.move_to_end((kind, h))
+            while len(self.known) > self.max_known:
+                self.known.popitem(last=False)
+
+    def save(self, cursor, prompts: dict, blocks: dict):
+        if prompts:
+            execute_values(
+                cursor,
+                "INSERT INTO ab_testing.prompt_versions (prompt_hash, content) VALUES %s ON CONFLICT DO NOTHING",
+                list(prompts.items()),
+            )
+        if blocks:
+            execute_values(
+                cursor,
+                "INSERT INTO ab_testing.message_blocks (block_hash, content) VALUES %s ON CONFLICT DO NOTHING",
+                list(blocks.items()),
+            )
+
+
+def load_conversations(cursor, conversation_ids):
+    """Returns {conversation_id: [system_prompt, [user, assistant], ...]}.
+
+    Rows written before content addressing was enabled are returned unchanged.
+    """
+    cursor.execute(
+        "SELECT conversation_id, conversation FROM ab_testing.ab_testing_conversations WHERE conversation_id = ANY(%s)",
+        (list(conversation_ids),),
+    )
+    rows = dict(cursor.fetchall())
+    packed = [c for c in rows.values() if is_packed(c)]
+    prompt_hashes = {c["prompt"] for c in packed}
+    block_hashes = {h for c in packed for turn in c["turns"] for h in turn}
+
+    prompts, blocks = {}, {}
+    if prompt_hashes:
+        cursor.execute(
+            "SELECT prompt_hash, content FROM ab_testing.prompt_versions WHERE prompt_hash = ANY(%s)",
+            (list(prompt_hashes),),
+        )
+        prompts = dict(cursor.fetchall())
+    if block_hashes:
+        cursor.execute(
+            "SELECT block_hash, content FROM ab_testing.message_blocks WHERE block_hash = ANY(%s)",
+            (list(block_hashes),),
+        )
+        blocks = dict(cursor.fetchall())
+
+    conversations = {}
+    for conversation_id, conversation in rows.items():
+        if is_packed(conversation):
+            conversation = [prompts[conversation["prompt"]]] + [
+                [blocks[h] for h in turn] for turn in conversation["turns"]
+            ]
+        conversations[conversation_id] = conversation
+    return conversations
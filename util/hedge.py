@@ -0,0 +1,212 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from util.metrics import registry
+
+hedge_requests = registry.counter(
+    "ansari_hedge_requests_total", "Requests through a hedger, by tool.", ["tool"]
+)
+hedges_fired = registry.counter("ansari_hedges_fired_total", "Second requests sent after the hedge delay.", ["tool"])
+hedges_won = registry.counter("ansari_hedges_won_total", "Hedged requests answered by the second request.", ["tool"])
+hedges_denied = registry.counter(
+    "ansari_hedges_denied_total",
+    "Hedges skipped because the tool's hedge budget was spent or no admission slot was free.",
+    ["tool"],
+)
+
+# Runs primary and hedge requests for the sync tools
+hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="ansari-hedge")
+
+
+class LatencyTracker:
+    """Recent request latencies of one tool, for picking the hedge delay."""
+
+    def __init__(self, window: int = 500):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q: float, min_samples: int):
+        """Returns the q-quantile of recent latencies, or None with fewer than min_samples."""
+        with self.lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgeBudget:
+    """Allows hedges for at most `ratio` of requests, plus a small burst.
+
+    Every request earns `ratio` tokens (capped at `burst`); a hedge spends one.
+    """
+
+    def __init__(self, ratio: float = 0.1, burst: float = 5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.lock = threading.Lock()
+
+    def earn(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def refund(self):
+        """Gives back a token spent on a hedge that was not sent after all."""
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+
+class Hedger:
+    """Hedged requests to one tool (one endpoint, with its own latency profile).
+
+    A request that has not answered within the `percentile` latency of recent
+    requests (at least `min_delay`) is sent a second time, if the tool's
+    hedge budget allows, and whichever answers first wins. A request that
+    fails waits for its twin. Hedging starts once `min_samples` latencies have
+    been observed.
+
+    With an `admission` of (AdmissionLimiter, client, deadline), the first
+    request waits for a slot, a hedge is only sent if a slot is free right
+    away, and each request holds its slot until it finishes, even when it lost.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        percentile: float = 0.95,
+        budget_ratio: float = 0.1,
+        min_delay: float = 0.05,
+        min_samples: int = 20,
+    ):
+        self.name = name
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies = LatencyTracker()
+        self.budget = HedgeBudget(budget_ratio)
+
+    def hedge_delay(self):
+        delay = self.latencies.percentile(self.percentile, self.min_samples)
+        return None if delay is None else max(self.min_delay, delay)
+
+    def timed(self, fn, args, kwargs, limiter=None):
+        """Runs one request, then releases its admission slot, if it holds one."""
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            if limiter is not None:
+                limiter.release()
+        self.latencies.add(time.monotonic() - start)
+        return result
+
+    async def atimed(self, fn, args, kwargs, limiter=None):
+        start = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        finally:
+            if limiter is not None:
+                limiter.release()
+        self.latencies.add(time.monotonic() - start)
+        return result
+
+    def may_hedge(self, limiter=None, client=None) -> bool:
+        # The budget goes first: an admission slot, once taken, also takes rate
+        # tokens from the limiter's bucket that releasing it would not give back
+        if self.budget.spend():
+            if limiter is None or limiter.try_acquire(client):
+                hedges_fired.inc(tool=self.name)
+                return True
+            self.budget.refund()
+        hedges_denied.inc(tool=self.name)
+        return False
+
+    def call(self, fn, *args, admission=None, **kwargs):
+        limiter, client, deadline = admission or (None, None, None)
+        if limiter is not None:
+            limiter.acquire(client, 1, deadline)
+        hedge_requests.inc(tool=self.name)
+        self.budget.earn()
+        delay = self.hedge_delay()
+        if delay is None:
+            return self.timed(fn, args, kwargs, limiter)
+        primary = hedge_executor.submit(self.timed, fn, args, kwargs, limiter)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.may_hedge(limiter, client):
+            return primary.result()
+        hedge = hedge_executor.submit(self.timed, fn, args, kwargs, limiter)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Both may finish in the same wait; any success wins over a failure
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        hedges_won.inc(tool=self.name)
+                    # The loser keeps running in the background; its result is dropped
+                    return future.result()
+        # Both requests failed
+        return primary.result()
+
+    async def acall(self, fn, *args, admission=None, **kwargs):
+        limiter, client, deadline = admission or (None, None, None)
+        if limiter is not None:
+            await limiter.aacquire(client, 1, deadline)
+        hedge_requests.inc(tool=self.name)
+        self.budget.earn()
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self.atimed(fn, args, kwargs, limiter)
+        primary = asyncio.ensure_future(self.atimed(fn, args, kwargs, limiter))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self.may_hedge(limiter, client):
+            return await primary
+        hedge = asyncio.ensure_future(self.atimed(fn, args, kwargs, limiter))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            hedges_won.inc(tool=self.name)
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(settings, name: str):
+    """Returns the process-wide Hedger for a tool, or None if hedging is off."""
+    if not settings.TOOL_HEDGING:
+        return None
+    with _hedgers_lock:
+        hedger = _hedgers.get(name)
+        if hedger is None:
+            hedger = _hedgers[name] = Hedger(
+                name,
+                percentile=settings.HEDGE_PERCENTILE,
+                budget_ratio=settings.HEDGE_BUDGET_RATIO,
+                min_delay=settings.HEDGE_MIN_DELAY,
+                min_samples=settings.HEDGE_MIN_SAMPLES,
+            )
+        return hedger
@@ -0,0 +1,120 @@
+import asyncio
+import atexit
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpStatusError(Exception):
+    """A search API answered with an error status."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class HttpClient:
+    """Keep-alive HTTP client shared by the search tools.
+
+    Wraps a pooled `requests.Session` for the sync path and one `httpx.AsyncClient`
+    per event loop for the async path, so repeated tool calls reuse TCP+TLS
+    connections to api.kalimat.dev and api.vectara.io instead of handshaking on
+    every request.
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = 4,
+        pool_maxsize: int = 20,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+    ):
+        """Creates a pooled client.
+
+        Args:
+            pool_connections: The number of hosts to keep connection pools for.
+            pool_maxsize: The maximum number of keep-alive connections per host.
+            connect_timeout: Seconds to wait for a connection to be established.
+            read_timeout: Seconds to wait for the server to send data.
+
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def async_client(self) -> httpx.AsyncClient:
+        # httpx clients are bound to the loop they were first used on.
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            connect_timeout, read_timeout = self.timeout
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.pool_connections * self.pool_maxsize,
+                    max_keepalive_connections=self.pool_connections * self.pool_maxsize,
+                ),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def aget(self, url, **kwargs):
+        return await self.async_client().get(url, **kwargs)
+
+    async def apost(self, url, **kwargs):
+        return await self.async_client().post(url, **kwargs)
+
+    async def aclose(self):
+        """Closes the running event loop's async client, if it has one."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def close(self):
+        """Closes the session and every event loop's async client. On a running loop
+        the close is scheduled; on an idle one it runs to completion; a closed loop
+        has already dropped its connections."""
+        self.session.close()
+        for loop, client in list(self._async_clients.items()):
+            self._async_clients.pop(loop, None)
+            if loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            else:
+                loop.run_until_complete(client.aclose())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client(settings) -> HttpClient:
+    """Returns the process-wide HttpClient, creating it from settings on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient(
+                pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                connect_timeout=settings.HTTP_CONNECT_TIMEOUT,
+                read_timeout=settings.HTTP_READ_TIMEOUT,
+            )
+            atexit.register(_client.close)
+        return _client
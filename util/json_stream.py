@@ -0,0 +1,64 @@
+import json
+
+
+class JsonStringFieldWatcher:
+    """Watches a JSON object arrive in chunks for one top-level string field.
+
+    `feed` scans each chunk once, tracking just enough lexical state (nesting
+    depth, string and escape state, key vs value position) to notice the moment
+    the watched field's string value closes. It returns the decoded value on that
+    call and None otherwise, so a caller can act on e.g. a function call's
+    "query" argument before the model has finished emitting the arguments.
+    """
+
+    def __init__(self, field: str = "query"):
+        self.field = field
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_parts = []
+        self.expect_key = False
+        self.current_key = None
+        self.value = None
+        self.found = False
+
+    def feed(self, chunk: str):
+        if self.found:
+            return None
+        for c in chunk:
+            if self.in_string:
+                self.string_parts.append(c)
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    if self._end_string(json.loads("".join(self.string_parts))):
+                        return self.value
+            elif c == '"':
+                self.in_string = True
+                self.string_parts = [c]
+            elif c in "{[":
+                self.depth += 1
+                self.expect_key = c == "{" and self.depth == 1
+            elif c in "}]":
+                self.depth -= 1
+            elif c == ":" and self.depth == 1:
+                self.expect_key = False
+            elif c == "," and self.depth == 1:
+                self.expect_key = True
+                self.current_key = None
+        return None
+
+    def _end_string(self, s) -> bool:
+        if self.depth != 1:
+            return False
+        if self.expect_key:
+            self.current_key = s
+            return False
+        if self.current_key == self.field:
+            self.value = s
+            self.found = True
+            return True
+        return False
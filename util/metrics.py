@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+COUNT_BUCKETS = (1, 2, 3, 4, 5, 8, 13, 21)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """A Prometheus-style histogram with cumulative buckets, one series per label set."""
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets + ("+Inf",), series):
+                    lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {series[-1]}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {series[-2]}")
+        return lines
+
+
+class Counter:
+    """A Prometheus-style counter, one series per label set."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.series[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """A Prometheus-style gauge, one series per label set."""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            self.series[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        metric = Gauge(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+turn_seconds = registry.histogram("ansari_turn_seconds", "Total time to answer one user message.", ["variant"])
+first_token_seconds = registry.histogram(
+    "ansari_time_to_first_token_seconds", "Time from the user message to the first streamed text.", ["variant"]
+)
+turn_rounds = registry.histogram("ansari_turn_rounds", "LLM rounds needed for one user message.", ["variant"], COUNT_BUCKETS)
+retry_sleep_seconds = registry.histogram(
+    "ansari_retry_sleep_seconds", "Time spent sleeping before retries in one turn.", ["variant"]
+)
+prompt_tokens = registry.histogram("ansari_prompt_tokens", "Prompt tokens sent in one turn.", ["variant"], TOKEN_BUCKETS)
+completion_tokens = registry.histogram(
+    "ansari_completion_tokens", "Completion tokens received in one turn.", ["variant"], TOKEN_BUCKETS
+)
+tool_call_seconds = registry.histogram(
+    "ansari_tool_call_seconds", "Time a turn waited for one tool call, cache hits included.", ["variant", "tool"]
+)
+tool_request_seconds = registry.histogram(
+    "ansari_tool_request_seconds", "Latency of tool API requests (Kalimat, Vectara).", ["tool"]
+)
+turn_failures = registry.counter("ansari_turn_failures_total", "Turns aborted after too many failures.", ["variant"])
+
+
+class TurnMetrics:
+    """Collects the phases of one agent turn (one user message, one side)."""
+
+    __slots__ = ("variant", "start", "first_token", "end", "retry_sleep", "tool_seconds", "tool_calls")
+
+    def __init__(self, variant: str):
+        self.variant = variant
+        self.start = time.monotonic()
+        self.first_token = None
+        self.end = None
+        self.retry_sleep = 0.0
+        self.tool_seconds = defaultdict(float)
+        self.tool_calls = 0
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+
+    def add_tool_call(self, tool: str, seconds: float):
+        self.tool_seconds[tool] += seconds
+        self.tool_calls += 1
+        tool_call_seconds.observe(seconds, variant=self.variant, tool=tool)
+
+    def finish(self, round_stats):
+        """Records the turn in the histograms. `round_stats` are the session's per-round token counts."""
+        self.end = time.monotonic()
+        summary = self.as_dict(round_stats)
+        turn_seconds.observe(summary["total_seconds"], variant=self.variant)
+        if summary["ttft_seconds"] is not None:
+            first_token_seconds.observe(summary["ttft_seconds"], variant=self.variant)
+        turn_rounds.observe(summary["rounds"], variant=self.variant)
+        retry_sleep_seconds.observe(summary["retry_sleep_seconds"], variant=self.variant)
+        prompt_tokens.observe(summary["prompt_tokens"], variant=self.variant)
+        completion_tokens.observe(summary["completion_tokens"], variant=self.variant)
+        return summary
+
+    def as_dict(self, round_stats) -> dict:
+        end = self.end if self.end is not None else time.monotonic()
+        return {
+            "variant": self.variant,
+            "total_seconds": round(end - self.start, 3),
+            "ttft_seconds": None if self.first_token is None else round(self.first_token - self.start, 3),
+            "rounds": len(round_stats),
+            "retry_sleep_seconds": self.retry_sleep,
+            "prompt_tokens": sum(s["prompt_tokens"] for s in round_stats),
+            "completion_tokens": sum(s.get("completion_tokens", 0) for s in round_stats),
+            "tool_calls": self.tool_calls,
+            "tool_seconds": {tool: round(s, 3) for tool, s in self.tool_seconds.items()},
+        }
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serves the registry at http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
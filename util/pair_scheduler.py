@@ -0,0 +1,66 @@
+import itertools
+import math
+import random
+import threading
+
+from util.vote_analytics import pair_counts
+
+
+def normal_cdf(z: float) -> float:
+    return 0.5 * (1 + math.erf(z / math.sqrt(2)))
+
+
+def ranking_uncertainty(model_1_wins, model_2_wins, ties, both_bad) -> float:
+    """Probability, under a Beta posterior on P(model 1 beats model 2), that the
+    pair's apparent order is wrong: 0.5 with no votes, near 0 once it is clear.
+
+    Ties and both-bad votes count half a win for each side, as in the ratings.
+    """
+    a = 1 + model_1_wins + (ties + both_bad) / 2
+    b = 1 + model_2_wins + (ties + both_bad) / 2
+    mean = a / (a + b)
+    sd = math.sqrt(a * b / ((a + b) ** 2 * (a + b + 1)))
+    return normal_cdf(-abs(mean - 0.5) / sd)
+
+
+class PairScheduler:
+    """Picks which two variants a new conversation compares.
+
+    Each pair is drawn with probability proportional to its ranking
+    uncertainty (plus `explore`, so no pair is starved), so votes go to pairs
+    whose order is still open rather than to pairs already decided. With two
+    variants this is the usual coin flip. Sides are shuffled, so a variant is A
+    or B equally often.
+    """
+
+    def __init__(self, model_ids, explore: float = 0.02, seed=None):
+        self.pairs = list(itertools.combinations(sorted(model_ids), 2))
+        self.explore = explore
+        self.counts = {pair: (0, 0, 0, 0) for pair in self.pairs}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def seed(self, counts: dict):
+        """Starts from stored counts: (model_1_id, model_2_id) -> (wins 1, wins 2, ties, both bad)."""
+        with self.lock:
+            for pair, pair_counts in counts.items():
+                if pair in self.counts:
+                    self.counts[pair] = tuple(pair_counts)
+
+    def record(self, model_a_id, model_b_id, vote):
+        model_1_id, model_2_id, added = pair_counts(model_a_id, model_b_id, vote)
+        with self.lock:
+            pair = (model_1_id, model_2_id)
+            if pair in self.counts:
+                self.counts[pair] = tuple(c + a for c, a in zip(self.counts[pair], added))
+
+    def weights(self):
+        with self.lock:
+            return [ranking_uncertainty(*self.counts[pair]) + self.explore for pair in self.pairs]
+
+    def next_pair(self):
+        """Returns (model_a_id, model_b_id) for a new conversation."""
+        weights = self.weights()
+        with self.lock:
+            pair = self.random.choices(self.pairs, weights)[0]
+            return pair if self.random.random() < 0.5 else pair[::-1]
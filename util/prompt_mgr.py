@@ -1,33 +1,142 @@
+import os
+import threading
+import time
+from string import Formatter
 from typing import Union
 
 from pydantic import BaseModel
 
 
+class CompiledTemplate:
+    """A prompt file parsed once into literal text and replacement fields.
+
+    Templates without fields are formatted at compile time, so rendering them
+    is free. Fields that are not plain names (attribute or index lookups) fall
+    back to `str.format`.
+    """
+
+    __slots__ = ("mtime", "text", "static", "pieces", "simple")
+
+    def __init__(self, text: str, mtime: float):
+        self.mtime = mtime
+        self.text = text
+        self.pieces = list(Formatter().parse(text))
+        self.simple = all(name is None or name.isidentifier() for _, name, _, _ in self.pieces)
+        self.static = text.format() if all(name is None for _, name, _, _ in self.pieces) else None
+
+    def render(self, **kwargs) -> str:
+        if self.static is not None:
+            return self.static
+        if not self.simple:
+            return self.text.format(**kwargs)
+        out = []
+        for literal, name, spec, conversion in self.pieces:
+            out.append(literal)
+            if name is None:
+                continue
+            value = kwargs[name]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            elif conversion == "a":
+                value = ascii(value)
+            out.append(format(value, spec))
+        return "".join(out)
+
+
+class TemplateRegistry:
+    """Process-wide cache of compiled prompt templates, keyed by file path.
+
+    A template is recompiled only when its file's mtime changes. With hot reload,
+    the mtime is polled at most once every `check_interval` seconds per file
+    (or the interval passed to `get`), so editing a prompt during an experiment
+    takes effect within that interval without touching the disk on every render.
+    """
+
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self.templates = {}  # file path -> CompiledTemplate
+        self.checked_at = {}  # file path -> monotonic time of the last mtime check
+        self.lock = threading.Lock()
+
+    def get(self, file_path: str, hot_reload: bool = True, check_interval: Union[float, None] = None) -> CompiledTemplate:
+        template = self.templates.get(file_path)
+        if template is not None:
+            if not hot_reload:
+                return template
+            now = time.monotonic()
+            if check_interval is None:
+                check_interval = self.check_interval
+            if now - self.checked_at.get(file_path, 0.0) < check_interval:
+                return template
+            self.checked_at[file_path] = now
+            if os.stat(file_path).st_mtime == template.mtime:
+                return template
+        return self.load(file_path)
+
+    def load(self, file_path: str) -> CompiledTemplate:
+        with self.lock:
+            mtime = os.stat(file_path).st_mtime
+            template = self.templates.get(file_path)
+            if template is None or template.mtime != mtime:
+                with open(file_path, "r") as f:
+                    template = CompiledTemplate(f.read(), mtime)
+                self.templates[file_path] = template
+            self.checked_at[file_path] = time.monotonic()
+            return template
+
+    def preload(self, src_dir: str):
+        """Compiles every prompt in src_dir, so static prompts are ready at startup."""
+        for name in sorted(os.listdir(src_dir)):
+            if name.endswith(".txt"):
+                self.load(os.path.join(src_dir, name))
+
+
+templates = TemplateRegistry()
+
+
 class Prompt(BaseModel):
     file_path: str
     cached: Union[str, None] = None
     hot_reload: bool = True
+    check_interval: Union[float, None] = None
 
     def render(self, **kwargs) -> str:
-        if (self.cached is None) or (self.hot_reload):
-            with open(self.file_path, "r") as f:
-                self.cached = f.read()
-        return self.cached.format(**kwargs)
+        template = templates.get(self.file_path, self.hot_reload, self.check_interval)
+        self.cached = template.text
+        return template.render(**kwargs)
 
 
 class PromptMgr:
-    def __init__(self, hot_reload: bool = True, src_dir: str = "resources/prompts"):
+    def __init__(
+        self,
+        hot_reload: bool = True,
+        src_dir: str = "resources/prompts",
+        preload: bool = False,
+        check_interval: Union[float, None] = None,
+    ):
         """Creates a prompt manager.
 
         Args:
-            hot_reload: If true, reloads the prompt every time it is called.
+            hot_reload: If true, picks up changes to a prompt file (checked by
+                mtime, see TemplateRegistry) when it is rendered.
             src_dir: The directory where the prompts are stored.
+            preload: If true, compiles every prompt in src_dir now.
+            check_interval: If set, how often (in seconds) prompt files are
+                checked for changes by this manager's prompts. Defaults to the
+                registry's interval.
 
         """
         self.hot_reload = hot_reload
         self.src_dir = src_dir
+        self.check_interval = check_interval
+        if preload:
+            templates.preload(src_dir)
 
     def bind(self, prompt_id: str) -> Prompt:
         return Prompt(
-            file_path=f"{self.src_dir}/{prompt_id}.txt", hot_reload=self.hot_reload
+            file_path=f"{self.src_dir}/{prompt_id}.txt",
+            hot_reload=self.hot_reload,
+            check_interval=self.check_interval,
         )
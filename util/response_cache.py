@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from util.metrics import registry
+
+response_cache_hits = registry.counter(
+    "ansari_response_cache_hits_total", "LLM rounds replayed from the response cache.", ["variant"]
+)
+response_cache_misses = registry.counter(
+    "ansari_response_cache_misses_total", "Cacheable LLM rounds sent to the model.", ["variant"]
+)
+
+# Message fields that affect the model's answer
+MESSAGE_FIELDS = ("role", "name", "content", "function_call", "tool_calls", "tool_call_id")
+
+
+class Delta:
+    """A replayed streaming delta, with the attribute and `in`/item access of litellm's."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def __contains__(self, key):
+        return key in self.__dict__
+
+    def __getitem__(self, key):
+        return self.__dict__[key]
+
+    def get(self, key, default=None):
+        return self.__dict__.get(key, default)
+
+
+class Chunk:
+    __slots__ = ("choices",)
+
+    def __init__(self, delta):
+        self.choices = [Delta(delta=delta)]
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes Unicode form and whitespace only. Unlike a search query, case is
+    kept, since the model sees it and may answer differently cased text differently."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def normalize_message(message: dict) -> dict:
+    """Keeps the fields that matter, with user text normalized by normalize_text."""
+    normalized = {field: message[field] for field in MESSAGE_FIELDS if message.get(field) is not None}
+    if message["role"] == "user" and isinstance(message.get("content"), str):
+        normalized["content"] = normalize_text(message["content"])
+    return normalized
+
+
+def record_delta(delta):
+    """Converts a streamed delta to plain data: ("c", text), ("f", name, arguments), ("t", calls) or ("end",)."""
+    tool_calls = delta.get("tool_calls")
+    if tool_calls:
+        return ("t", [(c.index, c.id, c.function.name, c.function.arguments) for c in tool_calls])
+    function_call = delta.get("function_call")
+    if function_call:
+        return ("f", function_call.name, function_call.arguments)
+    if delta.get("content") is not None:
+        return ("c", delta.content)
+    return ("end",)
+
+
+def replay_delta(record):
+    kind = record[0]
+    if kind == "t":
+        calls = [
+            Delta(index=index, id=id, function=Delta(name=name, arguments=arguments))
+            for index, id, name, arguments in record[1]
+        ]
+        return Delta(content=None, function_call=None, tool_calls=calls)
+    if kind == "f":
+        return Delta(content=None, function_call=Delta(name=record[1], arguments=record[2]), tool_calls=None)
+    if kind == "c":
+        return Delta(content=record[1], function_call=None, tool_calls=None)
+    return Delta(content=None, function_call=None, tool_calls=None)
+
+
+class ResponseCache:
+    """Full LLM responses of deterministic (temperature 0) rounds, for one variant.
+
+    Entries are keyed on the model, a hash of the system prompt, the rest of the
+    messages sent (user text normalized) and the functions or tools offered. A
+    response is stored as the sequence of its streamed deltas, so a hit replays
+    the same chunks, text or function call, that the model streamed. The cache
+    holds at most `max_bytes` of responses, evicting the least recently used,
+    and expires entries after `ttl` seconds.
+
+    Each delta is stored with how long the model took to send it, and a hit
+    replays the deltas at that pace, sped up by `replay_speed` (0 replays them
+    at once). An instant answer would stand out next to the other side of a
+    comparison and bias the vote.
+    """
+
+    def __init__(
+        self, variant: str, max_bytes: int = 64 * 1024 * 1024, ttl: float = 24 * 3600, replay_speed: float = 1.0
+    ):
+        self.variant = variant
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.replay_speed = replay_speed
+        self.entries = OrderedDict()  # key -> (expires_at, size, deltas)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(args: dict) -> Optional[str]:
+        """Builds a key from litellm completion args, or returns None if the round is not deterministic."""
+        if args.get("temperature") != 0:
+            return None
+        messages = args["messages"]
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        offered = {name: args[name] for name in ("functions", "tools", "response_format") if name in args}
+        parts = [
+            args["model"],
+            hashlib.sha256(system.encode()).hexdigest(),
+            [normalize_message(m) for m in messages if m["role"] != "system"],
+            offered,
+        ]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def get(self, key: str):
+        """Returns the recorded (seconds waited, delta) pairs for key, or None on a miss."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, size, deltas = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    response_cache_hits.inc(variant=self.variant)
+                    return deltas
+                del self.entries[key]
+                self.size -= size
+        response_cache_misses.inc(variant=self.variant)
+        return None
+
+    def set(self, key: str, deltas):
+        size = len(json.dumps(deltas, ensure_ascii=False).encode())
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (time.time() + self.ttl, size, deltas)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def record(self, key: str, response, started: float = None):
+        """Passes a streamed response through, storing it once its end is reached.
+
+        Each delta is stored with the time spent waiting for it, not counting the
+        time the caller spent on the previous one; the first wait counts from
+        `started` (a time.monotonic() taken before the request was sent), if given.
+        """
+        deltas = []
+        chunks = iter(response)
+        asked = time.monotonic() if started is None else started
+        while True:
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            deltas.append((time.monotonic() - asked, record_delta(chunk.choices[0].delta)))
+            if deltas[-1][1] == ("end",):
+                self.set(key, deltas)
+            yield chunk
+            asked = time.monotonic()
+        if deltas and deltas[-1][1] != ("end",):
+            self.set(key, deltas)
+
+    async def arecord(self, key: str, response, started: float = None):
+        deltas = []
+        chunks = response.__aiter__()
+        asked = time.monotonic() if started is None else started
+        while True:
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            deltas.append((time.monotonic() - asked, record_delta(chunk.choices[0].delta)))
+            if deltas[-1][1] == ("end",):
+                self.set(key, deltas)
+            yield chunk
+            asked = time.monotonic()
+        if deltas and deltas[-1][1] != ("end",):
+            self.set(key, deltas)
+
+    def replay(self, deltas):
+        for waited, record in deltas:
+            if self.replay_speed:
+                time.sleep(waited / self.replay_speed)
+            yield Chunk(replay_delta(record))
+
+    async def areplay(self, deltas):
+        for waited, record in deltas:
+            if self.replay_speed:
+                await asyncio.sleep(waited / self.replay_speed)
+            yield Chunk(replay_delta(record))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(settings, variant: str) -> Optional[ResponseCache]:
+    """Returns the process-wide ResponseCache of a variant, or None if response caching is off.
+
+    Each variant has its own cache and byte budget, so one side's traffic never
+    evicts the other's answers.
+    """
+    if not settings.RESPONSE_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        cache = _caches.get(variant)
+        if cache is None:
+            cache = _caches[variant] = ResponseCache(
+                variant,
+                max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+                ttl=settings.RESPONSE_CACHE_TTL,
+                replay_speed=settings.RESPONSE_CACHE_REPLAY_SPEED,
+            )
+        return cache
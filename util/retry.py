@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+import requests
+from tenacity import AsyncRetrying, Retrying, retry_if_exception
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUSES = {408, 409, 425, 429}
+# Error class names (litellm/openai) that are transient even without a status code
+RETRYABLE_NAMES = {"APIConnectionError", "APITimeoutError", "Timeout", "RateLimitError", "ServiceUnavailableError"}
+
+
+class DeadlineExceeded(Exception):
+    """The turn ran out of its wall-time budget."""
+
+
+class Deadline:
+    """A wall-time budget. `seconds=None` (or 0) means no limit."""
+
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds=None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded("Turn deadline exceeded")
+
+    def timeout(self, limit=None):
+        """Returns the time left capped to `limit`, or None if neither bounds it.
+        Raises DeadlineExceeded if no time is left."""
+        self.check()
+        remaining = self.remaining() if limit is None else min(limit, self.remaining())
+        return None if remaining == float("inf") else remaining
+
+
+def status_code(exc):
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Classifies an error as transient (worth retrying) or fatal.
+
+    Transient: timeouts, dropped connections, HTTP 408/409/425/429 and 5xx.
+    Fatal: everything else, e.g. bad requests, authentication errors, context
+    length errors, malformed arguments, and an exceeded turn deadline.
+    """
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    code = status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUSES or code >= 500
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return True
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return type(exc).__name__ in RETRYABLE_NAMES
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, bounded by attempts and a deadline.
+
+    The n-th retry waits a random time up to min(max_backoff,
+    initial_backoff * 2**(n-1)) seconds. No retry is attempted if the error is
+    not retryable, `max_attempts` have been made, or the wait would not leave
+    any of the deadline.
+    """
+
+    def __init__(self, max_attempts: int = 3, initial_backoff: float = 0.5, max_backoff: float = 8.0, classify=is_retryable):
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.classify = classify
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1)))
+
+    def retry_delay(self, exc, attempt: int, deadline=None):
+        """Returns how long to wait before the next attempt, or None to give up.
+
+        Args:
+            exc: The error raised by attempt number `attempt` (starting at 1).
+            attempt: The number of attempts made so far.
+            deadline: An optional Deadline the wait must fit in.
+
+        """
+        if attempt >= self.max_attempts or not self.classify(exc):
+            return None
+        delay = self.backoff(attempt)
+        if deadline is not None and deadline.remaining() <= delay:
+            return None
+        return delay
+
+    def retrying_args(self, deadline, on_sleep):
+        delays = {}  # attempt number -> wait, so stop and wait agree
+
+        def wait(retry_state):
+            attempt = retry_state.attempt_number
+            if attempt not in delays:
+                delays[attempt] = self.backoff(attempt)
+            return delays[attempt]
+
+        def stop(retry_state):
+            if retry_state.attempt_number >= self.max_attempts:
+                return True
+            return deadline is not None and deadline.remaining() <= wait(retry_state)
+
+        def before_sleep(retry_state):
+            delay = wait(retry_state)
+            logger.warning(
+                f"Attempt {retry_state.attempt_number} failed ({retry_state.outcome.exception()!r}), "
+                f"retrying in {delay:.2f}s"
+            )
+            if on_sleep:
+                on_sleep(delay)
+
+        return dict(
+            retry=retry_if_exception(self.classify),
+            stop=stop,
+            wait=wait,
+            before_sleep=before_sleep,
+            reraise=True,
+        )
+
+    def call(self, fn, *args, deadline=None, on_sleep=None, **kwargs):
+        """Calls fn, retrying per this policy. `on_sleep` is called with each wait."""
+        return Retrying(**self.retrying_args(deadline, on_sleep))(fn, *args, **kwargs)
+
+    async def acall(self, fn, *args, deadline=None, on_sleep=None, **kwargs):
+        """Awaits fn(*args, **kwargs), retrying per this policy; waits with asyncio.sleep."""
+        return await AsyncRetrying(sleep=asyncio.sleep, **self.retrying_args(deadline, on_sleep))(fn, *args, **kwargs)
+
@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+from util.metrics import registry
+
+sessions_evicted = registry.counter(
+    "ansari_sessions_evicted_total", "Conversations dropped from the session store, by reason.", ["reason"]
+)
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def chat_pairs(message_history):
+    """Rebuilds the [user, answer] pairs a Chatbot shows from a stored message history."""
+    pairs = []
+    for message in message_history:
+        if message["role"] == "user":
+            pairs.append([message["content"], ""])
+        elif message["role"] == "assistant" and message.get("content") and pairs:
+            pairs[-1][1] = message["content"]
+    return pairs
+
+
+def drop_last_turn(message_history):
+    """Returns the history before its last user message, and that message's text."""
+    last = max((i for i, m in enumerate(message_history) if m["role"] == "user"), default=None)
+    if last is None:
+        return message_history, None
+    return message_history[:last], message_history[last]["content"]
+
+
+class SessionStore:
+    """Server-side conversations of the comparison UI, keyed by session id.
+
+    A conversation is a dict of plain data (each side's message history, tool
+    results included), kept as zlib-compressed JSON. The store holds at most
+    `max_sessions` conversations and `max_bytes` of compressed data, evicting
+    the least recently used, and drops conversations idle for more than
+    `idle_ttl` seconds.
+    """
+
+    def __init__(self, max_sessions: int = 10000, max_bytes: int = 256 * 1024 * 1024, idle_ttl: float = 3600):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.entries = OrderedDict()  # session id -> (last used, compressed conversation)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, session_id) -> Optional[dict]:
+        """Returns a copy of the conversation, or None if it is unknown or was evicted."""
+        if session_id is None:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            self._evict_idle(now)
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return None
+            self.entries[session_id] = (now, entry[1])
+            self.entries.move_to_end(session_id)
+        return json.loads(zlib.decompress(entry[1]))
+
+    def put(self, session_id, conversation: dict):
+        data = zlib.compress(json.dumps(conversation, ensure_ascii=False, separators=(",", ":")).encode(), 1)
+        now = time.monotonic()
+        with self.lock:
+            old = self.entries.pop(session_id, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[session_id] = (now, data)
+            self.size += len(data)
+            self._evict_idle(now)
+            while len(self.entries) > self.max_sessions or (self.size > self.max_bytes and len(self.entries) > 1):
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                sessions_evicted.inc(reason="capacity")
+
+    def discard(self, session_id):
+        with self.lock:
+            entry = self.entries.pop(session_id, None)
+            if entry is not None:
+                self.size -= len(entry[1])
+
+    def _evict_idle(self, now):
+        # Entries are in least recently used order, so the idle ones are at the front
+        while self.entries:
+            session_id, (last_used, data) = next(iter(self.entries.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self.entries[session_id]
+            self.size -= len(data)
+            sessions_evicted.inc(reason="idle")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"sessions": len(self.entries), "bytes": self.size}
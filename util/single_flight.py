@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import weakref
+
+from util.retry import DeadlineExceeded
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc = None
+
+
+def timeout(deadline):
+    """Seconds left on an optional Deadline, or None if unbounded."""
+    if deadline is None or deadline.expires_at is None:
+        return None
+    return max(0.0, deadline.remaining())
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one upstream call.
+
+    The first caller for a key runs the function; callers that arrive while it
+    is in flight wait for it and receive the same result (or exception). Once the
+    call finishes the key is forgotten, so later calls run again. `do` serves
+    threads and `ado` serves coroutines on an event loop. A caller that waits
+    for another's call gives up with DeadlineExceeded once its own `deadline`
+    passes; the call itself carries on for the others.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tasks = weakref.WeakKeyDictionary()  # loop -> {key: task}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn, deadline=None):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            if not call.done.wait(timeout(deadline)):
+                raise DeadlineExceeded("Turn deadline exceeded waiting for a shared call")
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.exc = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    async def ado(self, key, coro_fn, deadline=None):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            tasks = self.tasks.setdefault(loop, {})
+            task = tasks.get(key)
+            if task is not None:
+                self.shared += 1
+            else:
+                task = tasks[key] = loop.create_task(coro_fn())
+                task.add_done_callback(lambda t: tasks.pop(key, None))
+                self.leaders += 1
+        # Shield so a cancelled or timed-out caller does not cancel the call for the others
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout(deadline))
+        except asyncio.TimeoutError:
+            if task.done():
+                raise  # the call itself timed out
+            raise DeadlineExceeded("Turn deadline exceeded waiting for a shared call")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"leaders": self.leaders, "shared": self.shared}
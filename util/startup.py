@@ -0,0 +1,80 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """Wall time of the named phases of process startup.
+
+    Times are measured from when this module was first imported, which app.py
+    does before anything heavy. `phase` times a block, `mark` records a moment
+    (such as the port opening), and `report` renders both in order.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events = []  # (name, seconds since start, duration or None)
+        self.lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    @contextmanager
+    def phase(self, name: str):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.events.append((name, end - self.start, end - begin))
+
+    def mark(self, name: str):
+        with self.lock:
+            self.events.append((name, self.elapsed(), None))
+
+    def as_list(self) -> list:
+        """Returns the events as [{"name", "at", "seconds"}], `seconds` being None for marks."""
+        with self.lock:
+            events = list(self.events)
+        return [
+            {"name": name, "at": round(at, 4), "seconds": None if duration is None else round(duration, 4)}
+            for name, at, duration in events
+        ]
+
+    def report(self) -> str:
+        return format_events(self.as_list())
+
+
+def format_events(events) -> str:
+    """Renders StartupProfile.as_list() events, one line each: time since start, duration, name."""
+    lines = []
+    for event in events:
+        took = f"{event['seconds'] * 1000:8.1f} ms" if event["seconds"] is not None else " " * 11
+        lines.append(f"{event['at'] * 1000:9.1f} ms  {took}  {event['name']}")
+    return "\n".join(lines)
+
+
+startup = StartupProfile()
+
+
+def warm_up_in_background(*steps):
+    """Runs (name, fn) steps one after another in a daemon thread, timing each as a startup phase.
+    A failing step is logged and skipped; whatever it prepares is then built on first use."""
+
+    def run():
+        for name, fn in steps:
+            try:
+                with startup.phase(name):
+                    fn()
+            except Exception as e:
+                logger.warning(f"Warm-up step {name} failed: {e}")
+        startup.mark("warm")
+        logger.info("Startup profile:\n" + startup.report())
+
+    thread = threading.Thread(target=run, daemon=True, name="warm-up")
+    thread.start()
+    return thread
@@ -0,0 +1,163 @@
+import asyncio
+import queue
+import threading
+import time
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def merge_streams(*streams, idle_tick=None):
+    """Merges several generators into one, advancing each in its own thread.
+
+    Yields (index, item) tuples in the order items become available, so a slow
+    stream (e.g. one blocked on a tool call) never holds up the others. If any
+    stream raises, the exception is re-raised in the consumer. Closing the
+    merged generator signals the workers to stop and close their streams.
+
+    Args:
+        streams: The generators to merge.
+        idle_tick: If set, yields (None, None) whenever no stream has produced
+            an item for this many seconds, so consumers can flush buffers.
+
+    """
+    out = queue.Queue()
+    stop = threading.Event()
+
+    def pump(index, stream):
+        try:
+            for item in stream:
+                if stop.is_set():
+                    break
+                out.put((index, item))
+        except Exception as e:
+            out.put((index, _Failure(e)))
+        finally:
+            if stop.is_set() and hasattr(stream, "close"):
+                try:
+                    stream.close()
+                except Exception:
+                    pass
+            out.put((index, _DONE))
+
+    workers = [
+        threading.Thread(target=pump, args=(i, s), daemon=True, name=f"merge-stream-{i}")
+        for i, s in enumerate(streams)
+    ]
+    for w in workers:
+        w.start()
+
+    remaining = len(workers)
+    try:
+        while remaining:
+            try:
+                index, item = out.get(timeout=idle_tick)
+            except queue.Empty:
+                yield None, None
+                continue
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, _Failure):
+                raise item.exc
+            else:
+                yield index, item
+    finally:
+        stop.set()
+
+
+async def amerge_streams(*streams, idle_tick=None):
+    """Async counterpart of `merge_streams` for async generators.
+
+    Each stream is driven by its own task on the running event loop.
+    """
+    out = asyncio.Queue()
+
+    async def pump(index, stream):
+        try:
+            async for item in stream:
+                await out.put((index, item))
+        except Exception as e:
+            await out.put((index, _Failure(e)))
+        finally:
+            await out.put((index, _DONE))
+
+    tasks = [asyncio.create_task(pump(i, s)) for i, s in enumerate(streams)]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            try:
+                index, item = await asyncio.wait_for(out.get(), idle_tick)
+            except asyncio.TimeoutError:
+                yield None, None
+                continue
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, _Failure):
+                raise item.exc
+            else:
+                yield index, item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class _Coalescer:
+    """Accumulates (index, text) chunks until they are due to be flushed."""
+
+    def __init__(self, interval, max_chars):
+        self.interval = interval
+        self.max_chars = max_chars
+        self.pending = {}
+        self.pending_chars = 0
+        self.last_flush = float("-inf")
+
+    def add(self, index, text) -> bool:
+        """Adds a chunk; returns True if the pending text should be flushed now."""
+        if text:
+            self.pending[index] = self.pending.get(index, "") + text
+            self.pending_chars += len(text)
+        if not self.pending:
+            return False
+        return self.pending_chars >= self.max_chars or time.monotonic() - self.last_flush >= self.interval
+
+    def flush(self):
+        batch, self.pending, self.pending_chars = self.pending, {}, 0
+        self.last_flush = time.monotonic()
+        return batch
+
+
+def coalesce_chunks(items, interval: float = 0.05, max_chars: int = 200):
+    """Batches (index, text) items into {index: text} dicts.
+
+    A batch is emitted once `interval` seconds have passed since the previous
+    one or `max_chars` characters are pending, and when `items` ends. Empty
+    chunks never produce a batch of their own, but do flush text that is due,
+    as do the (None, None) idle ticks of `merge_streams`. The first text is
+    emitted as soon as it arrives. With `interval` 0 every non-empty chunk is its own batch.
+
+    Args:
+        items: An iterable of (index, text) pairs, e.g. from `merge_streams`.
+        interval: Minimum time in seconds between batches.
+        max_chars: Pending characters that force a batch before `interval`.
+
+    """
+    coalescer = _Coalescer(interval, max_chars)
+    for index, text in items:
+        if coalescer.add(index, text):
+            yield coalescer.flush()
+    if coalescer.pending:
+        yield coalescer.flush()
+
+
+async def acoalesce_chunks(items, interval: float = 0.05, max_chars: int = 200):
+    """Async counterpart of `coalesce_chunks`."""
+    coalescer = _Coalescer(interval, max_chars)
+    async for index, text in items:
+        if coalescer.add(index, text):
+            yield coalescer.flush()
+    if coalescer.pending:
+        yield coalescer.flush()
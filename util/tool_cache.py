@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+
+def normalize_query(query: str) -> str:
+    """Normalizes a search query so trivially different spellings share a cache entry."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class ToolCache:
+    """LRU cache with TTL for tool results, with an optional SQLite tier.
+
+    Entries are keyed on (tool name, normalized query, num_results[, kind]). The in-memory
+    tier holds at most `max_entries` results and evicts the least recently used;
+    the SQLite tier, when `sqlite_path` is set, keeps results across restarts and
+    is consulted on a memory miss. Both tiers expire entries after `ttl` seconds.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 6 * 3600, sqlite_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.db = None
+        if sqlite_path:
+            self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.execute("DELETE FROM tool_cache WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+
+    @staticmethod
+    def make_key(tool_name: str, query: str, num_results: int, kind: str = "list") -> str:
+        """Builds a cache key. `kind` separates result formats of the same search."""
+        parts = [tool_name, normalize_query(query), num_results]
+        if kind != "list":
+            parts.append(kind)
+        return json.dumps(parts, ensure_ascii=False)
+
+    def get(self, key: str):
+        """Returns the cached value for key, or None on a miss."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.expirations += 1
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, expires_at FROM tool_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._put(key, row[1], value)
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value):
+        expires_at = time.time() + self.ttl
+        with self.lock:
+            self._put(key, expires_at, value)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO tool_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at),
+                )
+                self.db.commit()
+
+    def _put(self, key, expires_at, value):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tool_cache(settings) -> Optional[ToolCache]:
+    """Returns the process-wide ToolCache, or None if caching is disabled."""
+    global _cache
+    if not settings.TOOL_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ToolCache(
+                max_entries=settings.TOOL_CACHE_MAX_ENTRIES,
+                ttl=settings.TOOL_CACHE_TTL,
+                sqlite_path=settings.TOOL_CACHE_SQLITE_PATH,
+            )
+        return _cache
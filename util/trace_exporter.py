@@ -0,0 +1,159 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from util.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+traces_exported = registry.counter("ansari_traces_exported_total", "Generations sent to Langfuse.")
+traces_dropped = registry.counter(
+    "ansari_traces_dropped_total", "Generations not sent to Langfuse, by reason.", ["reason"]
+)
+
+
+class TraceExporter:
+    """Sends Langfuse traces from a background thread, off the request path.
+
+    `submit` only enqueues a generation record. A worker thread drains the
+    bounded queue in batches of up to `batch_size`, creating the trace and
+    generation for each record and flushing the Langfuse client once per batch.
+
+    Under pressure the exporter sheds load instead of blocking: once the queue
+    is more than half full only `pressure_sample_rate` of new records are kept,
+    and records arriving at a full queue are dropped. The Langfuse client is
+    created and its credentials checked on the worker thread when the first
+    batch is sent; if that fails, records are dropped and the check is retried
+    after `auth_retry_interval` seconds. The queue is flushed when the process
+    exits.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = 1000,
+        batch_size: int = 50,
+        flush_interval: float = 2.0,
+        pressure_sample_rate: float = 0.1,
+        auth_retry_interval: float = 60.0,
+        client_factory=None,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pressure_sample_rate = pressure_sample_rate
+        self.auth_retry_interval = auth_retry_interval
+        self.client_factory = client_factory
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.high_water = max_queue // 2
+        self.client = None
+        self.next_auth = 0.0
+        self.stopping = threading.Event()
+        self.worker = threading.Thread(target=self.run, daemon=True, name="trace-exporter")
+        self.worker.start()
+        atexit.register(self.close)
+
+    def submit(self, trace_id, start_time, end_time, model, prompt, completion) -> bool:
+        """Queues one generation. Returns False if it was sampled out or dropped."""
+        if self.queue.qsize() >= self.high_water and random.random() >= self.pressure_sample_rate:
+            traces_dropped.inc(reason="sampled")
+            return False
+        try:
+            self.queue.put_nowait((trace_id, start_time, end_time, model, prompt, completion))
+            return True
+        except queue.Full:
+            traces_dropped.inc(reason="queue_full")
+            return False
+
+    def run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self.next_batch()
+            if batch:
+                self.export(batch)
+
+    def next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def get_client(self):
+        if self.client is None and time.monotonic() >= self.next_auth:
+            try:
+                if self.client_factory is None:
+                    from langfuse import Langfuse
+
+                    self.client_factory = Langfuse
+                client = self.client_factory()
+                client.auth_check()
+                self.client = client
+            except Exception as e:
+                self.next_auth = time.monotonic() + self.auth_retry_interval
+                logger.error(f"Langfuse unavailable, dropping traces for {self.auth_retry_interval}s: {e}")
+        return self.client
+
+    def export(self, batch):
+        client = self.get_client()
+        if client is None:
+            traces_dropped.inc(len(batch), reason="unavailable")
+            return
+        from langfuse.model import CreateGeneration, CreateTrace
+
+        sent = 0
+        for trace_id, start_time, end_time, model, prompt, completion in batch:
+            try:
+                trace = client.trace(CreateTrace(id=trace_id, name="ansari-trace"))
+                trace.generation(
+                    CreateGeneration(
+                        name="ansari-gen",
+                        startTime=start_time,
+                        endTime=end_time,
+                        model=model,
+                        prompt=prompt,
+                        completion=completion,
+                    )
+                )
+                sent += 1
+            except Exception as e:
+                logger.error(f"Could not export trace {trace_id}: {e}")
+                traces_dropped.inc(reason="error")
+        try:
+            client.flush()
+        except Exception as e:
+            logger.error(f"Could not flush {sent} traces to Langfuse: {e}")
+            traces_dropped.inc(sent, reason="error")
+            return
+        traces_exported.inc(sent)
+
+    def close(self, timeout: float = 10.0):
+        """Sends everything still queued, waiting at most `timeout` seconds."""
+        self.stopping.set()
+        self.worker.join(timeout)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_trace_exporter(settings):
+    """Returns the process-wide TraceExporter, or None if Langfuse is not configured."""
+    global _exporter
+    if not os.environ.get("LANGFUSE_SECRET_KEY"):
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = TraceExporter(
+                max_queue=settings.TRACE_QUEUE_SIZE,
+                batch_size=settings.TRACE_BATCH_SIZE,
+                flush_interval=settings.TRACE_FLUSH_INTERVAL,
+                pressure_sample_rate=settings.TRACE_PRESSURE_SAMPLE_RATE,
+            )
+        return _exporter
@@ -0,0 +1,337 @@
+"""Win rates and ratings of the compared models, from running vote counts.
+
+VoteWriter increments one row of ab_testing.vote_aggregates per (experiment,
+model pair) as it inserts votes (see resources/sql/003_vote_aggregates.sql), so
+reading results costs one row per pair however many votes were cast. From the
+counts this module derives win/tie/both-bad rates, Bradley-Terry ratings on the
+Elo scale (ties and both-bad votes count half a win each, as in Chatbot Arena),
+and bootstrap confidence intervals. Since votes are exchangeable, the
+bootstrap resamples the counts multinomially, which also takes constant time.
+
+    python -m util.vote_analytics
+    python -m util.vote_analytics --rebuild 1 2 3   # recount from ab_testing_comparisons
+"""
+
+import argparse
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+# Vote values stored by the app, and the counter each one increments for the (A, B) order
+VOTE_COLUMNS = {"A": "a_wins", "B": "b_wins", "Tie": "ties", "Both Bad": "both_bad"}
+ELO_BASE = 1000.0
+ELO_SCALE = 400.0
+
+
+def pair_counts(model_a_id, model_b_id, vote, count=1):
+    """Returns (model_1_id, model_2_id, (model_1 wins, model_2 wins, ties, both bad)) for `count`
+    identical votes, with model_1 the lower id."""
+    counts = dict.fromkeys(VOTE_COLUMNS.values(), 0)
+    counts[VOTE_COLUMNS[vote]] = count
+    if model_a_id <= model_b_id:
+        return model_a_id, model_b_id, (counts["a_wins"], counts["b_wins"], counts["ties"], counts["both_bad"])
+    return model_b_id, model_a_id, (counts["b_wins"], counts["a_wins"], counts["ties"], counts["both_bad"])
+
+
+def upsert_aggregates(cursor, experiment_id, votes):
+    """Adds (model_a_id, model_b_id, user_vote[, count]) votes to the running counts."""
+    totals = {}
+    for model_a_id, model_b_id, vote, *count in votes:
+        if vote not in VOTE_COLUMNS:
+            continue
+        model_1_id, model_2_id, counts = pair_counts(model_a_id, model_b_id, vote, *count)
+        total = totals.get((model_1_id, model_2_id), (0, 0, 0, 0))
+        totals[(model_1_id, model_2_id)] = tuple(t + c for t, c in zip(total, counts))
+    if not totals:
+        return
+    now = datetime.now(timezone.utc)
+    # One row per pair: ON CONFLICT cannot update the same row twice in one statement
+    execute_values(
+        cursor,
+        """INSERT INTO ab_testing.vote_aggregates
+               (experiment_id, model_1_id, model_2_id, model_1_wins, model_2_wins, ties, both_bad, updated_at)
+           VALUES %s
+           ON CONFLICT (experiment_id, model_1_id, model_2_id) DO UPDATE SET
+               model_1_wins = vote_aggregates.model_1_wins + EXCLUDED.model_1_wins,
+               model_2_wins = vote_aggregates.model_2_wins + EXCLUDED.model_2_wins,
+               ties = vote_aggregates.ties + EXCLUDED.ties,
+               both_bad = vote_aggregates.both_bad + EXCLUDED.both_bad,
+               updated_at = EXCLUDED.updated_at""",
+        [(experiment_id, m1, m2, *counts, now) for (m1, m2), counts in totals.items()],
+    )
+
+
+def fetch_counts(cursor, experiment_id):
+    """Returns {(model_1_id, model_2_id): (model_1 wins, model_2 wins, ties, both bad)} of an experiment."""
+    cursor.execute(
+        "SELECT model_1_id, model_2_id, model_1_wins, model_2_wins, ties, both_bad "
+        "FROM ab_testing.vote_aggregates WHERE experiment_id = %s",
+        (experiment_id,),
+    )
+    return {(row[0], row[1]): tuple(row[2:]) for row in cursor.fetchall()}
+
+
+def rebuild_counts(cursor, experiment_id, model_ids):
+    """Recounts the votes between the given models from ab_testing_comparisons,
+    replacing the experiment's aggregate rows.
+
+    The comparisons table does not record the experiment, so every vote between
+    two of the models is attributed to `experiment_id`.
+    """
+    model_ids = list(model_ids)
+    cursor.execute("DELETE FROM ab_testing.vote_aggregates WHERE experiment_id = %s", (experiment_id,))
+    cursor.execute(
+        "SELECT model_a_id, model_b_id, user_vote, count(*) FROM ab_testing.ab_testing_comparisons "
+        "WHERE model_a_id = ANY(%s) AND model_b_id = ANY(%s) GROUP BY 1, 2, 3",
+        (model_ids, model_ids),
+    )
+    votes = cursor.fetchall()
+    upsert_aggregates(cursor, experiment_id, votes)
+    return sum(count for _, _, vote, count in votes if vote in VOTE_COLUMNS)
+
+
+def binomial(rng, n, p):
+    """Draws from Binomial(n, p); uses the normal approximation for large n."""
+    if p <= 0:
+        return 0
+    if p >= 1:
+        return n
+    if n <= 200:
+        return sum(rng.random() < p for _ in range(n))
+    draw = round(rng.gauss(n * p, math.sqrt(n * p * (1 - p))))
+    return min(n, max(0, draw))
+
+
+def multinomial(rng, n, probabilities):
+    counts = []
+    remaining, mass = n, 1.0
+    for p in probabilities[:-1]:
+        count = binomial(rng, remaining, p / mass) if mass > 0 else 0
+        counts.append(count)
+        remaining -= count
+        mass -= p
+    counts.append(remaining)
+    return counts
+
+
+def rating_gap(model_1_wins, model_2_wins, ties, both_bad):
+    """Bradley-Terry rating of model 1 minus model 2 on the Elo scale.
+
+    Ties and both-bad votes count half a win for each side; half a vote of
+    smoothing keeps the gap finite when one side has every win.
+    """
+    n = model_1_wins + model_2_wins + ties + both_bad
+    score = (model_1_wins + (ties + both_bad) / 2 + 0.5) / (n + 1)
+    return ELO_SCALE * math.log10(score / (1 - score))
+
+
+def fit_ratings(counts, iterations: int = 100) -> dict:
+    """Fits Bradley-Terry strengths to all pairs' counts and returns Elo-scale ratings by model id.
+
+    Uses the minorize-maximize updates of Hunter (2004). Ties and both-bad votes
+    count half a win for each side, and every compared pair gets half a win of
+    smoothing per side, so with two models this matches `rating_gap`.
+    """
+    wins = {}  # (winner, loser) -> votes
+    for (model_1_id, model_2_id), (model_1_wins, model_2_wins, ties, both_bad) in counts.items():
+        shared = (ties + both_bad) / 2 + 0.5
+        wins[(model_1_id, model_2_id)] = model_1_wins + shared
+        wins[(model_2_id, model_1_id)] = model_2_wins + shared
+    models = sorted({model for pair in counts for model in pair})
+    strength = dict.fromkeys(models, 1.0)
+    for _ in range(iterations):
+        updated = {}
+        for i in models:
+            won = sum(w for (winner, _), w in wins.items() if winner == i)
+            games = sum(
+                (wins[(i, j)] + wins[(j, i)]) / (strength[i] + strength[j])
+                for (winner, j) in wins
+                if winner == i
+            )
+            updated[i] = won / games
+        scale = math.exp(sum(math.log(s) for s in updated.values()) / len(updated))
+        strength = {model: s / scale for model, s in updated.items()}
+    return {model: ELO_BASE + ELO_SCALE * math.log10(s) for model, s in strength.items()}
+
+
+def percentile_interval(samples, level):
+    ordered = sorted(samples)
+    tail = (1 - level) / 2
+    low = ordered[int(tail * (len(ordered) - 1))]
+    high = ordered[int(math.ceil((1 - tail) * (len(ordered) - 1)))]
+    return low, high
+
+
+def summarize(counts, samples: int = 1000, level: float = 0.95, seed: int = 0) -> dict:
+    """Win rates, ratings and bootstrap intervals from (model_1 wins, model_2 wins, ties, both bad)."""
+    model_1_wins, model_2_wins, ties, both_bad = counts
+    n = sum(counts)
+    gap = rating_gap(*counts)
+    summary = {
+        "votes": n,
+        "model_1_wins": model_1_wins,
+        "model_2_wins": model_2_wins,
+        "ties": ties,
+        "both_bad": both_bad,
+        "model_1_win_rate": model_1_wins / n if n else None,
+        "model_2_win_rate": model_2_wins / n if n else None,
+        "tie_rate": ties / n if n else None,
+        "both_bad_rate": both_bad / n if n else None,
+        "model_1_rating": ELO_BASE + gap / 2,
+        "model_2_rating": ELO_BASE - gap / 2,
+        "model_1_rating_ci": None,
+        "model_1_win_rate_ci": None,
+        "confidence": level,
+    }
+    if n:
+        rng = random.Random(seed)
+        probabilities = [c / n for c in counts]
+        gaps, win_rates = [], []
+        for _ in range(samples):
+            resampled = multinomial(rng, n, probabilities)
+            gaps.append(rating_gap(*resampled))
+            win_rates.append(resampled[0] / n)
+        low, high = percentile_interval(gaps, level)
+        summary["model_1_rating_ci"] = (ELO_BASE + low / 2, ELO_BASE + high / 2)
+        summary["model_1_win_rate_ci"] = percentile_interval(win_rates, level)
+    return summary
+
+
+def format_summary(summary, model_1_label="Model 1", model_2_label="Model 2") -> str:
+    """Renders a summary as a Markdown table."""
+    if not summary["votes"]:
+        return "No votes yet."
+
+    def pct(value):
+        return f"{100 * value:.1f}%"
+
+    rating_low, rating_high = summary["model_1_rating_ci"]
+    win_low, win_high = summary["model_1_win_rate_ci"]
+    level = f"{100 * summary['confidence']:g}%"
+    return "\n".join(
+        [
+            f"**{summary['votes']} votes**",
+            "",
+            "| | Votes | Share | Pair rating |",
+            "|---|---:|---:|---:|",
+            f"| {model_1_label} wins | {summary['model_1_wins']} | {pct(summary['model_1_win_rate'])} | {summary['model_1_rating']:.0f} |",
+            f"| {model_2_label} wins | {summary['model_2_wins']} | {pct(summary['model_2_win_rate'])} | {summary['model_2_rating']:.0f} |",
+            f"| Tie | {summary['ties']} | {pct(summary['tie_rate'])} | |",
+            f"| Both bad | {summary['both_bad']} | {pct(summary['both_bad_rate'])} | |",
+            "",
+            f"{level} bootstrap intervals for {model_1_label}: rating {rating_low:.0f} to {rating_high:.0f}, "
+            f"win rate {pct(win_low)} to {pct(win_high)}.",
+        ]
+    )
+
+
+def format_leaderboard(ratings, counts, label=str) -> str:
+    """Renders ratings from `fit_ratings` as a Markdown table, best first."""
+    votes = dict.fromkeys(ratings, 0)
+    for pair, pair_counts in counts.items():
+        for model in pair:
+            votes[model] += sum(pair_counts)
+    lines = ["| Variant | Rating | Votes |", "|---|---:|---:|"]
+    for model in sorted(ratings, key=ratings.get, reverse=True):
+        lines.append(f"| {label(model)} | {ratings[model]:.0f} | {votes[model]} |")
+    return "\n".join(lines)
+
+
+class VoteAnalytics:
+    """Reads and summarizes the running vote counts of one experiment.
+
+    Results are cached for `cache_seconds`, so refreshing the Results tab does
+    not query the database or rerun the bootstraps on every click.
+    """
+
+    def __init__(self, db_config: dict, experiment_id: int, samples: int = 1000, cache_seconds: float = 10.0):
+        self.db_config = db_config
+        self.experiment_id = experiment_id
+        self.samples = samples
+        self.cache_seconds = cache_seconds
+        self.cached = None
+        self.cached_at = float("-inf")
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        with psycopg2.connect(**self.db_config) as conn:
+            with conn.cursor() as cur:
+                counts = fetch_counts(cur, self.experiment_id)
+        conn.close()
+        return counts
+
+    def results(self):
+        """Returns (counts, ratings, summaries): each pair's counts and summary, and the joint ratings."""
+        with self.lock:
+            if time.monotonic() - self.cached_at >= self.cache_seconds:
+                counts = self.fetch()
+                summaries = {pair: summarize(c, self.samples) for pair, c in counts.items()}
+                self.cached = (counts, fit_ratings(counts) if counts else {}, summaries)
+                self.cached_at = time.monotonic()
+            return self.cached
+
+    def rebuild(self, model_ids) -> int:
+        """Recounts the votes between the given models. Returns the number of votes."""
+        with psycopg2.connect(**self.db_config) as conn:
+            with conn.cursor() as cur:
+                votes = rebuild_counts(cur, self.experiment_id, model_ids)
+        conn.close()
+        with self.lock:
+            self.cached_at = float("-inf")
+        return votes
+
+
+def format_results(results, label=lambda model_id: f"Model {model_id}") -> str:
+    """Renders VoteAnalytics.results() as Markdown: the leaderboard, then each pair, most voted first."""
+    counts, ratings, summaries = results
+    if not counts:
+        return "No votes yet."
+    sections = ["### Leaderboard", format_leaderboard(ratings, counts, label)]
+    for pair in sorted(summaries, key=lambda p: summaries[p]["votes"], reverse=True):
+        sections += [
+            f"### {label(pair[0])} vs {label(pair[1])}",
+            format_summary(summaries[pair], label(pair[0]), label(pair[1])),
+        ]
+    return "\n\n".join(sections)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rebuild",
+        type=int,
+        nargs="*",
+        metavar="MODEL_ID",
+        help="recount votes between these models (default: AB_TESTING_MODEL_1_ID and _2_ID) from ab_testing_comparisons",
+    )
+    parser.add_argument("--samples", type=int, default=1000, help="bootstrap resamples")
+    args = parser.parse_args()
+
+    analytics = VoteAnalytics(
+        {
+            "dbname": os.getenv("AB_TESTING_DB_NAME", "mwk"),
+            "user": os.getenv("AB_TESTING_DB_USER", "mwk"),
+            "password": os.getenv("AB_TESTING_DB_PASSWORD", "pw"),
+            "host": os.getenv("AB_TESTING_DB_HOST", "localhost"),
+            "port": os.getenv("AB_TESTING_DB_PORT", "5432"),
+        },
+        int(os.getenv("AB_TESTING_EXPERIMENT_ID", 1)),
+        samples=args.samples,
+    )
+    if args.rebuild is not None:
+        model_ids = args.rebuild or [
+            int(os.getenv("AB_TESTING_MODEL_1_ID", 1)),
+            int(os.getenv("AB_TESTING_MODEL_2_ID", 2)),
+        ]
+        print(f"Recounted {analytics.rebuild(model_ids)} votes")
+    print(format_results(analytics.results()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+from util.conversation_store import ConversationStore
+from util.vote_analytics import upsert_aggregates
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying: the connection dropped or the server is restarting
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+def insert_conversations(cursor, rows):
+    """Inserts (model_id, conversation) rows and returns their ids in order."""
+    now = datetime.now(timezone.utc)
+    return [
+        r[0]
+        for r in execute_values(
+            cursor,
+            "INSERT INTO ab_testing.ab_testing_conversations (model_id, conversation, timestamp) VALUES %s RETURNING conversation_id",
+            [(model_id, Json(conversation), now) for model_id, conversation in rows],
+            page_size=len(rows),
+            fetch=True,
+        )
+    ]
+
+
+def insert_comparisons(cursor, rows, with_metrics=False):
+    """Inserts (model_a_id, model_b_id, conversation_a_id, conversation_b_id, user_vote, timestamp) rows,
+    with a trailing metrics value if `with_metrics` is set."""
+    columns = "model_a_id, model_b_id, conversation_a_id, conversation_b_id, user_vote, timestamp"
+    if with_metrics:
+        columns += ", metrics"
+    execute_values(
+        cursor,
+        f"INSERT INTO ab_testing.ab_testing_comparisons ({columns}) VALUES %s",
+        rows,
+        page_size=len(rows),
+    )
+
+
+class VoteWriter:
+    """Persists A/B votes in the background, in batches, over one connection.
+
+    `submit` only enqueues the vote, so a vote click returns immediately. A worker
+    thread drains the bounded queue in batches of up to `batch_size`, writing each
+    batch in one transaction with multi-row INSERTs. Transient database errors are
+    retried with backoff over a fresh connection; the queue is flushed when the
+    process exits.
+
+    If `content_addressed` is set, conversations are stored as hash references
+    into the prompt and message tables (see util.conversation_store). If
+    `store_metrics` is set, the per-turn metrics passed to `submit` are written
+    to the comparison's metrics column. If `experiment_id` is given, each batch
+    also adds its votes to the experiment's running counts (see
+    util.vote_analytics).
+    """
+
+    def __init__(
+        self,
+        db_config: dict,
+        max_queue: int = 10000,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_retries: int = 3,
+        content_addressed: bool = False,
+        store_metrics: bool = False,
+        experiment_id=None,
+    ):
+        self.db_config = db_config
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.store = ConversationStore() if content_addressed else None
+        self.store_metrics = store_metrics
+        self.experiment_id = experiment_id
+        self.conn = None  # only the worker thread uses it
+        self.dropped = 0
+        self.written = 0
+        self.stopping = threading.Event()
+        self.worker = threading.Thread(target=self.run, daemon=True, name="vote-writer")
+        self.worker.start()
+        atexit.register(self.close)
+
+    def submit(self, model_a_id, model_b_id, conversation_a, conversation_b, user_vote, metrics=None) -> bool:
+        """Queues one vote. Returns False if the queue is full and the vote was dropped."""
+        vote = (model_a_id, model_b_id, conversation_a, conversation_b, user_vote, datetime.now(timezone.utc), metrics)
+        try:
+            self.queue.put_nowait(vote)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"Vote queue full, dropping vote ({self.dropped} dropped so far)")
+            return False
+
+    def run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            batch = self.next_batch()
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception:
+                    # Drop just this batch; the writer must stay alive for later votes
+                    logger.exception(f"Failed to write {len(batch)} votes, dropping them")
+                    self.dropped += len(batch)
+
+    def next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(**self.db_config)
+        return self.conn
+
+    def disconnect(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                conn = self.connect()
+                prompts, blocks = {}, {}
+                with conn:
+                    with conn.cursor() as cur:
+                        self.write_batch(cur, batch, prompts, blocks)
+                if self.store:
+                    self.store.mark_stored(prompts, blocks)
+                self.written += len(batch)
+                return
+            except TRANSIENT_ERRORS as e:
+                # The connection may be broken; the next attempt opens a new one
+                self.disconnect()
+                if attempt == self.max_retries:
+                    logger.error(f"Database error, dropping {len(batch)} votes: {e}")
+                    self.dropped += len(batch)
+                    return
+                delay = 0.5 * 2**attempt
+                logger.warning(f"Transient database error, retrying in {delay}s: {e}")
+            except psycopg2.Error as e:
+                logger.error(f"Database error, dropping {len(batch)} votes: {e}")
+                self.dropped += len(batch)
+                return
+            time.sleep(delay)
+
+    def write_batch(self, cursor, batch, prompts, blocks):
+        conversations = []
+        for model_a_id, model_b_id, conversation_a, conversation_b, _, _, _ in batch:
+            if self.store:
+                conversation_a = self.store.pack(conversation_a, prompts, blocks)
+                conversation_b = self.store.pack(conversation_b, prompts, blocks)
+            conversations.append((model_a_id, conversation_a))
+            conversations.append((model_b_id, conversation_b))
+        if self.store:
+            self.store.save(cursor, prompts, blocks)
+        ids = insert_conversations(cursor, conversations)
+        rows = []
+        for i, (model_a_id, model_b_id, _, _, user_vote, timestamp, metrics) in enumerate(batch):
+            row = (model_a_id, model_b_id, ids[2 * i], ids[2 * i + 1], user_vote, timestamp)
+            if self.store_metrics:
+                row += (Json(metrics) if metrics is not None else None,)
+            rows.append(row)
+        insert_comparisons(cursor, rows, self.store_metrics)
+        if self.experiment_id is not None:
+            upsert_aggregates(cursor, self.experiment_id, [(vote[0], vote[1], vote[4]) for vote in batch])
+
+    def close(self, timeout: float = 10.0):
+        """Writes out everything still queued, then closes the connection."""
+        self.stopping.set()
+        self.worker.join(timeout)
+        self.disconnect()